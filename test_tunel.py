@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""
+Equivalências entre os vários caminhos de desenho do túnel: NumPy vs
+Python, lote vs segmento a segmento, ladrilhos vs uma passagem, etc.,
+e o estado das caches. Todas correm sem Tk (HeadlessRenderer / Raster,
+ou o GameEngine sobre um canvas falso).
+"""
+import random
+import types
+
+import pytest
+
+import tunel
+
+needs_numpy = pytest.mark.skipif(tunel.np is None, reason="NumPy não instalado")
+
+SIZES = [(900, 600), (1920, 1080), (333, 777)]
+LODS = [None, tunel.LevelOfDetail()]
+
+
+@needs_numpy
+@pytest.mark.parametrize("lod", LODS)
+@pytest.mark.parametrize("phase", [0.0, 1.3])
+@pytest.mark.parametrize("w,h", SIZES)
+def test_joints_numpy_matches_python(w, h, phase, lod):
+    frames = tunel.tunnel_frames(w, h, 16, 200, 0.92, phase, lod)
+    parity = tunel.phase_parity(phase)
+    py = tunel.brick_joints(frames, False, parity, lod)
+    assert py
+    joints = tunel.brick_joints(frames, True, parity, lod)
+    assert joints.shape == (len(py), 4)
+    assert tunel.joint_tuples(joints) == py
+
+
+@pytest.mark.parametrize("lod", LODS)
+def test_joint_polylines_match_segments(lod):
+    w, h, line_width = 900, 600, 2
+    frames = tunel.tunnel_frames(w, h, 16, 70, 0.92, 0.0, lod)
+    joints = tunel.brick_joints(frames, None, 0, lod)
+    rings = tunel.visible_rings(frames, tunel._ring_threshold(lod))
+    jw = max(1, line_width - 1)
+
+    single = tunel.Raster(w, h)
+    tunel.draw_raster(single, rings, joints, line_width)
+
+    batched = tunel.Raster(w, h)
+    batched.rects(rings, line_width)
+    for pts in tunel.joint_polylines(frames, joints, lod):
+        xy = list(zip(pts[::2], pts[1::2]))
+        batched.lines([a + b for a, b in zip(xy, xy[1:])], jw)
+    assert batched.to_ppm() == single.to_ppm()
+
+
+def test_tiled_export_matches_single_pass(tmp_path):
+    w, h = 700, 450
+    renderer = tunel.HeadlessRenderer()
+    renderer.export(str(tmp_path / "single.ppm"), w, h)
+    renderer.export(str(tmp_path / "tiled.ppm"), w, h, tile=128, workers=2)
+    assert (tmp_path / "tiled.ppm").read_bytes() == (tmp_path / "single.ppm").read_bytes()
+
+
+@pytest.mark.parametrize("use_numpy", [True, False] if tunel.np is not None else [False])
+def test_tiled_filled_export_matches_single_pass(tmp_path, monkeypatch, use_numpy):
+    calls = {"brick_joints": 0, "export_tiled": 0}
+
+    def spy(name):
+        func = getattr(tunel, name)
+
+        def wrapper(*args, **kw):
+            calls[name] += 1
+            return func(*args, **kw)
+        monkeypatch.setattr(tunel, name, wrapper)
+
+    spy("brick_joints")
+    spy("export_tiled")
+    w, h = 500, 340
+    renderer = tunel.HeadlessRenderer(use_numpy=use_numpy)
+    renderer.filled = True
+    renderer.export(str(tmp_path / "single.ppm"), w, h)
+    renderer.export(str(tmp_path / "tiled.ppm"), w, h, tile=96, workers=2)
+    assert (tmp_path / "tiled.ppm").read_bytes() == (tmp_path / "single.ppm").read_bytes()
+    # --tile não é ignorado com --filled, e os tijolos reutilizam as juntas da cache
+    assert calls == {"brick_joints": 1, "export_tiled": 1}
+
+
+@needs_numpy
+def test_tile_segments_numpy_matches_python():
+    frames = tunel.tunnel_frames(700, 450, 16, 120, 0.92)
+    joints = tunel.brick_joints(frames, True)
+    segs = tunel.rect_segments(tunel.visible_rings(frames)) + tunel.joint_tuples(joints)
+    for tile in ((0, 0, 128, 128), (256, 128, 384, 256), (640, 384, 700, 450)):
+        py = tunel.tile_segments(segs, *tile, 2)
+        assert tunel.joint_tuples(tunel.tile_segments(tunel.np.array(segs), *tile, 2)) == py
+
+
+def test_ring_rect_closed_form_matches_recurrence():
+    rnd = random.Random(1234)
+    for _ in range(200):
+        w, h = rnd.randint(100, 4000), rnd.randint(100, 4000)
+        margin = rnd.uniform(0, 40)
+        scale = rnd.uniform(0.80, 0.97)
+        phase = rnd.uniform(0, 4)
+        px = rnd.uniform(2, 80)
+        frames = tunel.tunnel_frames(w, h, margin, 400, scale, phase)
+        for k, rect in enumerate(frames):
+            assert tunel.ring_rect(w, h, margin, scale, k, phase) == pytest.approx(rect, abs=1e-6)
+        count = next(k for k, (x1, y1, x2, y2) in enumerate(frames) if min(x2 - x1, y2 - y1) < px)
+        assert tunel.depth_for_size(w, h, margin, scale, px, phase) == count
+
+
+def test_sweep_matches_headless():
+    w, h = 240, 160
+    variants = tunel.sweep_variants([0.88, 0.92], [10, 40, 70], [16], [1, 3])
+    seen = set()
+    for i, v, raster in tunel.iter_sweep(w, h, variants, phase=0.5, workers=2):
+        renderer = tunel.HeadlessRenderer(margin=v.margin, depth_layers=v.depth_layers, scale=v.scale,
+                                          line_width=v.line_width)
+        renderer.running_bond_offset = 0.5
+        assert bytes(raster.buf) == bytes(renderer.render(w, h).buf), v
+        seen.add(i)
+    assert seen == set(range(len(variants)))
+
+
+def _camera_raster(w, h, segs):
+    raster = tunel.Raster(w, h)
+    raster.lines(segs, 2)
+    return raster.to_ppm()
+
+
+def _random_camera(rnd):
+    return tunel.Camera(x=rnd.uniform(-1.0, 1.0), y=rnd.uniform(-0.6, 0.6), z=rnd.uniform(0.0, 5.0),
+                        yaw=rnd.uniform(-60, 60), pitch=rnd.uniform(-40, 40), fov=rnd.uniform(60, 110))
+
+
+def test_culling_preserves_raster():
+    # túnel reto visto de dentro: nada fica escondido, o recorte só tira o que não se vê
+    w, h = 320, 240
+    world = tunel.tunnel_world(60)
+    rnd = random.Random(99)
+    culled = 0
+    for _ in range(20):
+        cam = _random_camera(rnd)
+        index, segs = tunel.project_world(world, cam, w, h)
+        _, kept, stats = tunel.cull_projected(world, cam, w, h, index, segs, 2)
+        culled += stats["frustum"] + stats["occluded"]
+        assert _camera_raster(w, h, kept) == _camera_raster(w, h, segs)
+    assert culled > 0
+
+
+def test_culling_curved_path_drops_hidden_segments():
+    # com curvas as linhas atrás das paredes (visíveis em wireframe) são ocultadas
+    w, h = 320, 240
+    path = tunel.TunnelPath.wavy()
+    world = tunel.tunnel_world(int(path.length) + 1, path=path)
+    rnd = random.Random(99)
+    for _ in range(10):
+        s = rnd.uniform(0, 100)
+        cam = path.camera(_random_camera(rnd)._replace(z=0.0), s)
+        start = int(s)
+        index, segs = tunel.project_world(world, cam, w, h, start, start + 40)
+        kept_index, kept, stats = tunel.cull_projected(world, cam, w, h, index, segs, 2, start, start + 40)
+        assert stats["occluded"] > 0
+        assert len(kept) == len(segs) - stats["frustum"] - stats["occluded"]
+        assert set(zip(kept_index, kept)) <= set(zip(index, segs))
+
+
+@needs_numpy
+@pytest.mark.parametrize("lod", LODS)
+def test_fill_numpy_matches_python(lod):
+    images = []
+    for use_numpy in (True, False):
+        renderer = tunel.HeadlessRenderer(depth_layers=200, use_numpy=use_numpy)
+        renderer.filled = True
+        renderer.lod = lod
+        images.append(renderer.render(900, 600).to_ppm())
+    assert images[0] == images[1]
+
+
+def test_geometry_cache_lru_eviction_and_stats():
+    cache = tunel.GeometryCache(2)
+    calls = []
+
+    def compute(key):
+        return lambda: calls.append(key) or key
+
+    for key in ("a", "b", "a", "c", "b"):
+        assert cache.get(key, compute(key)) == key
+    # "a" foi usado depois de "b", por isso "b" é que saiu quando entrou "c"
+    assert calls == ["a", "b", "c", "b"]
+    assert cache.stats() == {"hits": 1, "misses": 4, "size": 2, "maxsize": 2, "hit_rate": 0.2}
+
+    off = tunel.GeometryCache(0)
+    off.get("a", compute("a"))
+    off.get("a", compute("a"))
+    assert len(off) == 0 and off.stats()["misses"] == 2
+
+
+class StubCanvas:
+    """Canvas Tk mínimo em memória: guarda os itens (tipo, coords, opções) para comparar."""
+
+    def __init__(self, root=None, **kw):
+        self.items = {}
+        self.next_id = 0
+
+    def _create(self, kind, coords, kw):
+        self.next_id += 1
+        self.items[self.next_id] = [kind, list(coords), dict(kw)]
+        return self.next_id
+
+    def create_line(self, *coords, **kw):
+        return self._create("line", coords, kw)
+
+    def create_rectangle(self, *coords, **kw):
+        return self._create("rect", coords, kw)
+
+    def create_polygon(self, *coords, **kw):
+        return self._create("polygon", coords, kw)
+
+    def create_text(self, *coords, **kw):
+        return self._create("text", coords, kw)
+
+    def create_image(self, *coords, **kw):
+        return self._create("image", coords, kw)
+
+    def _ids(self, tag):
+        if tag == "all":
+            return list(self.items)
+        if isinstance(tag, int):
+            return [tag] if tag in self.items else []
+        return [i for i, (_, _, kw) in self.items.items()
+                if tag in (kw.get("tags") if isinstance(kw.get("tags"), tuple) else (kw.get("tags"),))]
+
+    def delete(self, *tags):
+        for tag in tags:
+            for i in self._ids(tag):
+                del self.items[i]
+
+    def coords(self, item, *coords):
+        self.items[item][1] = list(coords)
+
+    def itemconfigure(self, item, **kw):
+        for i in self._ids(item):
+            self.items[i][2].update(kw)
+
+    def find_all(self):
+        return tuple(self.items)
+
+    def bbox(self, item):
+        return (0, 0, 10, 10)
+
+    def visible(self):
+        return sorted((kind, tuple(coords), sorted(kw.items())) for kind, coords, kw in self.items.values()
+                      if kw.get("state") != "hidden")
+
+    def pack(self, **kw):
+        pass
+
+    def bind(self, *a):
+        pass
+
+    def configure(self, **kw):
+        pass
+
+    def winfo_width(self):
+        return 900
+
+    def winfo_height(self):
+        return 600
+
+    def tag_raise(self, *a):
+        pass
+
+    def tag_lower(self, *a):
+        pass
+
+
+class StubRoot:
+    def bind(self, *a):
+        pass
+
+    def after(self, ms, fn=None, *a):
+        return "after"
+
+    def after_idle(self, fn, *a):
+        return "idle"
+
+    def after_cancel(self, job):
+        pass
+
+
+@pytest.fixture
+def make_engine(monkeypatch):
+    """GameEngine sobre o StubCanvas (não precisa de Tk nem de display)."""
+    monkeypatch.setattr(tunel, "tk", types.SimpleNamespace(Canvas=StubCanvas, PhotoImage=dict))
+    return lambda **kw: tunel.GameEngine(StubRoot(), **kw)
+
+
+@pytest.mark.parametrize("lod", LODS)
+def test_incremental_layers_match_full_redraw(make_engine, monkeypatch, lod):
+    incremental = []
+    update = tunel.GameEngine._update_layers
+    monkeypatch.setattr(tunel.GameEngine, "_update_layers",
+                        lambda self, *a: incremental.append(self) or update(self, *a))
+    engine = make_engine()
+    engine.lod, engine.depth_layers = lod, 40
+    engine._drawn_state = None
+    engine.redraws(900, 600)
+    for depth in (120, 25, 200):
+        engine.depth_layers = depth
+        engine.redraws(900, 600)
+        full = make_engine()
+        full.lod, full.depth_layers = lod, depth
+        full._drawn_state = None  # força o redesenho completo
+        full.redraws(900, 600)
+        assert engine.canvas.visible() == full.canvas.visible(), depth
+        assert engine.item_count == full.item_count
+    assert incremental == [engine] * 3
+    # sem mudar a profundidade, o redesenho é completo (não incremental)
+    engine.redraws(900, 600)
+    assert incremental == [engine] * 3 and engine.canvas.visible() == full.canvas.visible()
+
+
+@pytest.mark.parametrize("lod", LODS)
+@pytest.mark.parametrize("phase", [0.0, 0.7, 1.3])
+def test_draw_commands_match_scene_geometry(phase, lod):
+    rings, joints = tunel.scene_geometry(900, 600, 16, 120, 0.92, phase, lod)
+    commands = list(tunel.iter_draw_commands(900, 600, 16, 120, 0.92, phase, lod, 3))
+    ring_cmds = [cmd for cmd in commands if isinstance(cmd, tunel.RingCmd)]
+    joint_cmds = [cmd for cmd in commands if isinstance(cmd, tunel.JointCmd)]
+    assert [cmd.rect for cmd in ring_cmds] == rings
+    # mesma geometria, noutra ordem (por par e não pela ordem dos kernels)
+    assert sorted(cmd.seg for cmd in joint_cmds) == sorted(map(tuple, joints))
+    assert {cmd.width for cmd in ring_cmds} == {3} and {cmd.width for cmd in joint_cmds} == {2}
+
+
+def test_render_stream_matches_render():
+    renderer = tunel.HeadlessRenderer(depth_layers=150)
+    renderer.running_bond_offset = 0.4
+    assert renderer.render_stream(900, 600).to_ppm() == renderer.render(900, 600).to_ppm()
+
+
+@pytest.mark.parametrize("lod", LODS)
+def test_scene_draw_matches_render(lod):
+    renderer = tunel.HeadlessRenderer(depth_layers=150)
+    renderer.lod = lod
+    scene = renderer.scene(900, 600)
+    rings, joints = renderer.geometry(900, 600)
+    scene_rings, scene_joints = scene.to_lists()
+    assert scene_rings == rings
+    assert sorted(scene_joints) == sorted(map(tuple, joints))
+    raster = tunel.Raster(900, 600)
+    scene.draw(raster)
+    assert raster.to_ppm() == renderer.render(900, 600).to_ppm()
+
+
+def test_loop_cache_slots_and_limits():
+    cache = tunel.LoopCache(max_frames=3, max_bytes=250)
+    cache.configure(("state",), 8)
+    assert cache.count == 8  # o período não é limitado por max_frames
+    for slot in range(8):
+        assert cache.slot(cache.phase(slot)) == slot
+        assert cache.slot(cache.phase(slot) + tunel.LoopCache.PERIOD) == slot
+    assert cache.slot(cache.phase(7) + 0.6 * tunel.LoopCache.PERIOD / 8) == 0
+
+    calls = []
+
+    def compute(slot, size):
+        return lambda: (calls.append(slot) or "frame%d" % slot, size)
+
+    assert cache.get(0, compute(0, 100)) == "frame0"
+    assert cache.get(1, compute(1, 100)) == "frame1"
+    assert cache.get(2, compute(2, 100)) == "frame2"  # passaria max_bytes: calculado mas não guardado
+    assert cache.get(3, compute(3, 10)) == "frame3"
+    assert cache.get(4, compute(4, 10)) == "frame4"   # já há max_frames guardados
+    for slot in range(5):
+        cache.get(slot, compute(slot, 10))
+    assert calls == [0, 1, 2, 3, 4, 2, 4]
+    stats = cache.stats()
+    assert (stats["frames"], stats["nbytes"], stats["hits"], stats["misses"]) == (3, 210, 3, 7)
+
+    cache.configure(("state",), 8)  # mesmo estado: mantém os frames
+    assert len(cache) == 3
+    cache.configure(("other",), 8)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+@pytest.mark.parametrize("lod", LODS)
+def test_brick_index_locate_matches_polygon(lod):
+    frames = tunel.tunnel_frames(900, 600, 16, 120, 0.92, 0.0, lod)
+    joints = tunel.brick_joints(frames, None, 0, lod)
+    index = tunel.BrickIndex(frames, joints, lod)
+    assert index.pairs
+    for k, runs in index.pairs.items():
+        for wall in range(4):
+            for i in range(len(runs[wall]) + 1):
+                poly = index.polygon((k, wall, i))
+                xs, ys = poly[::2], poly[1::2]
+                if abs(sum(xs[j - 1] * ys[j] - xs[j] * ys[j - 1] for j in range(4))) < 1e-6:
+                    continue  # sem meio tijolo, a primeira junta cai no canto: tijolo de área nula
+                # o centróide de um tijolo (quadrilátero convexo) está dentro dele
+                assert index.locate(sum(poly[::2]) / 4, sum(poly[1::2]) / 4) == (k, wall, i)
+    assert index.locate(2, 2) is None
+
+
+def test_retained_pool_restyles_only_on_change(make_engine):
+    engine = make_engine(retained=True)
+    engine.line_width = 5
+    engine.redraws(900, 600)
+    calls = []
+    configure = engine.canvas.itemconfigure
+    engine.canvas.itemconfigure = lambda item, **kw: calls.append(kw) or configure(item, **kw)
+    engine.redraws(900, 600)
+    assert calls == []  # nada mudou de estado nem de espessura: só coords()
+    widths = {(kind, kw["width"]) for kind, _, kw in engine.canvas.items.values()}
+    assert widths == {("rect", 5), ("line", 4)}
+
+    engine.depth_layers = 20
+    engine.redraws(900, 600)
+    assert calls and all(kw == {"state": "hidden"} for kw in calls)
+    engine.depth_layers, engine.line_width = 70, 3
+    engine.redraws(900, 600)
+    full = make_engine(retained=True)
+    full.line_width = 3
+    full.redraws(900, 600)
+    assert engine.canvas.visible() == full.canvas.visible()
+
+
+def test_clip_segments_liang_barsky():
+    box = (0.0, 0.0, 100.0, 50.0)
+    inside = (10.0, 10.0, 90.0, 40.0)
+    assert tunel.clip_segments([inside], *box) == [inside]
+    assert tunel.clip_segments([(-10, -10, -1, 60), (0, 60, 100, 70)], *box) == []
+    assert tunel.clip_segments([(-50, 25, 150, 25)], *box) == [(0.0, 25.0, 100.0, 25.0)]
+    rnd = random.Random(7)
+    for _ in range(500):
+        seg = tuple(rnd.uniform(-1e6, 1e6) for _ in range(4))
+        for x0, y0, x1, y1 in tunel.clip_segments([seg], *box):
+            for x, y in ((x0, y0), (x1, y1)):
+                assert -1e-6 <= x <= 100 + 1e-6 and -1e-6 <= y <= 50 + 1e-6
+                # continua sobre a reta do segmento original
+                ax, ay, bx, by = seg
+                cross = (bx - ax) * (y - ay) - (by - ay) * (x - ax)
+                assert abs(cross) <= 1e-9 * (abs(bx - ax) + abs(by - ay)) * 2e6
+
+
+def test_camera_raster_is_bounded_without_culling(make_engine, monkeypatch):
+    # de lado (yaw 90) o recorte no plano próximo dá segmentos com ~1e6 px
+    engine = make_engine(backend="raster", camera=tunel.Camera(yaw=90.0))
+    engine.culling = False
+    _, segs = tunel.project_world(engine._world(), engine._camera_view()[0], 900, 600)
+    assert max(max(abs(v) for v in s) for s in segs) > 1e5
+    drawn = []
+    lines = tunel.Raster.lines
+    monkeypatch.setattr(tunel.Raster, "lines", lambda self, segs, *a: drawn.extend(segs) or lines(self, segs, *a))
+    engine.redraws(900, 600)
+    pad = engine.line_width + 1e-6
+    assert drawn and all(-pad <= x <= 900 + pad and -pad <= y <= 600 + pad
+                         for s in drawn for x, y in (s[:2], s[2:]))
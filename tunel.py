@@ -1,10 +1,1676 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import tkinter as tk
-from typing import List, Tuple
+import argparse
+import bisect
+import concurrent.futures
+from array import array
+import csv
+import itertools
+import json
+import math
+import os
+import queue
+import statistics
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+try:  # NumPy é opcional: sem ele usa-se o caminho em Python puro
+    import numpy as np
+except ImportError:
+    np = None
+
+try:  # Tk só é preciso para a GUI (GameEngine); o render headless e a CLI não dependem dele
+    import tkinter as tk
+except ImportError:
+    tk = None
 
 Point = Tuple[float, float]
 Rect = Tuple[float, float, float, float]
+Segment = Tuple[float, float, float, float]
+# juntas: lista de segmentos, ou o array (N, 4) de joints_array() no caminho NumPy
+Joints = Union[List[Segment], "np.ndarray"]
+
+# ---------------------------------------------------------------------------
+# Núcleo de geometria: anéis (retângulos) e juntas dos tijolos.
+# Existe uma versão em Python puro e outra vetorizada em NumPy; ambas
+# produzem a mesma geometria, pela mesma ordem.
+# ---------------------------------------------------------------------------
+
+class LevelOfDetail(NamedTuple):
+    """
+    Limiares do nível de detalhe. Com LOD o número de juntas de cada anel
+    depende do seu tamanho no ecrã e a geometria deixa de ser gerada quando
+    os segmentos entre anéis ficam abaixo do pixel.
+    """
+    ring_px: float = 16.0       # anéis (e juntas) mais pequenos não são desenhados
+    brick_px: float = 12.0      # largura pretendida de um tijolo no ecrã
+    min_joints: int = 1         # juntas por parede, no mínimo...
+    max_joints: int = 16        # ... e no máximo
+    subpixel: float = 0.5       # passo mínimo entre anéis consecutivos (px)
+
+
+def _use_numpy(use_numpy: Optional[bool]) -> bool:
+    return np is not None if use_numpy is None else bool(use_numpy and np is not None)
+
+
+def _require_tk() -> None:
+    if tk is None:
+        raise RuntimeError("a GUI precisa do tkinter (use --headless num Python sem Tk)")
+
+
+def iter_frames(w: int, h: int, margin: float, depth_layers: int, scale: float,
+                phase: float = 0.0, min_step: float = 0.0, stop_below: float = 0.0) -> Iterator[Rect]:
+    """Os mesmos anéis de tunnel_frames(), gerados um a um (sem lista)."""
+    cx, cy = w / 2, h / 2
+    x1, y1, x2, y2 = margin, margin, w - margin, h - margin
+    frac = phase % 1.0
+    if frac:
+        # Fase fracionária: os anéis já avançaram parte de um passo em direção ao observador
+        grow = scale ** -frac
+        x1, y1 = cx + (x1 - cx) * grow, cy + (y1 - cy) * grow
+        x2, y2 = cx + (x2 - cx) * grow, cy + (y2 - cy) * grow
+
+    for _ in range(depth_layers):
+        yield (x1, y1, x2, y2)
+        if x2 - x1 < stop_below or y2 - y1 < stop_below:
+            break  # nada mais fundo do que este anel é desenhado
+        px1, py1 = x1, y1
+        # Aproximar ao centro por fator de escala
+        x1 = cx + (x1 - cx) * scale
+        y1 = cy + (y1 - cy) * scale
+        x2 = cx + (x2 - cx) * scale
+        y2 = cy + (y2 - cy) * scale
+        if abs(x2 - x1) < 2 or abs(y2 - y1) < 2:
+            break
+        if max(abs(x1 - px1), abs(y1 - py1)) < min_step:
+            break  # as juntas até ao próximo anel ficariam abaixo do pixel
+
+
+def _frames_py(w: int, h: int, margin: float, depth_layers: int, scale: float,
+               phase: float = 0.0, min_step: float = 0.0, stop_below: float = 0.0) -> List[Rect]:
+    return list(iter_frames(w, h, margin, depth_layers, scale, phase, min_step, stop_below))
+
+
+def ring_rect(w: int, h: int, margin: float, scale: float, k: float, phase: float = 0.0) -> Rect:
+    """
+    Anel k em O(1), sem gerar os anteriores: cx + (x - cx) * scale**(k - frac(phase)).
+    Não acumula o erro da recorrência, por isso pode diferir de tunnel_frames()
+    nos últimos bits.
+    """
+    cx, cy = w / 2, h / 2
+    f = scale ** (k - phase % 1.0)
+    return (cx + (margin - cx) * f, cy + (margin - cy) * f,
+            cx + (w - margin - cx) * f, cy + (h - margin - cy) * f)
+
+
+def ring_size(w: int, h: int, margin: float, scale: float, k: float, phase: float = 0.0) -> float:
+    """Menor lado (em px) do anel k."""
+    return (min(w, h) - 2 * margin) * scale ** (k - phase % 1.0)
+
+
+def depth_for_size(w: int, h: int, margin: float, scale: float, px: float, phase: float = 0.0) -> int:
+    """Primeiro índice k cujo anel tem menos de `px` pixels de largura ou altura (O(1))."""
+    size0 = ring_size(w, h, margin, scale, 0, phase)
+    if size0 < px:
+        return 0
+    if px <= 0 or scale >= 1.0:
+        raise ValueError("o túnel nunca fica abaixo de %r px com scale=%r" % (px, scale))
+    k = max(0, math.ceil(math.log(px / size0) / math.log(scale) + phase % 1.0))
+    # acerto de arredondamento do log
+    while k > 0 and ring_size(w, h, margin, scale, k - 1, phase) < px:
+        k -= 1
+    while ring_size(w, h, margin, scale, k, phase) >= px:
+        k += 1
+    return k
+
+
+def ring_range(w: int, h: int, margin: float, scale: float, start: int, stop: int,
+               phase: float = 0.0) -> List[Rect]:
+    """Anéis start..stop-1 em forma fechada (só os pedidos são calculados)."""
+    return [ring_rect(w, h, margin, scale, k, phase) for k in range(start, stop)]
+
+
+def joint_count(wall_px: float, lod: LevelOfDetail) -> int:
+    """Número de juntas para uma parede com `wall_px` pixels de comprimento."""
+    return max(lod.min_joints, min(lod.max_joints, int(wall_px / lod.brick_px)))
+
+
+def _pair_joints(a: Rect, b: Rect, sh: float, nx: int, ny: int) -> Iterator[Tuple[int, Segment]]:
+    # (parede, junta) entre os anéis a e b: nx juntas no teto/chão e ny nas
+    # paredes laterais, pela ordem dos kernels (0 teto, 1 chão, 2 esq., 3 dir.)
+    x1, y1, x2, y2 = a
+    xn1, yn1, xn2, yn2 = b
+    xx1, xxx1 = (x2 - x1) / nx, (xn2 - xn1) / nx
+    yy1, yyy1 = (y2 - y1) / ny, (yn2 - yn1) / ny
+    for nn in range(max(nx, ny)):
+        if nn < nx:
+            xa = x1 + int(xx1 * float(nn)) + xx1 * sh
+            xb = xn1 + int(xxx1 * float(nn)) + xxx1 * sh
+            yield 0, (xa, y1, xb, yn1)
+            yield 1, (xa, y2, xb, yn2)
+        if nn < ny:
+            ya = y1 + int(yy1 * float(nn)) + yy1 * sh
+            yb = yn1 + int(yyy1 * float(nn)) + yyy1 * sh
+            yield 2, (x1, ya, xn1, yb)
+            yield 3, (x2, ya, xn2, yb)
+
+
+def _joints_py(frames: List[Rect], parity: int = 0,
+               lod: Optional[LevelOfDetail] = None) -> List[Segment]:
+    # nx juntas no teto/chão e ny nas paredes laterais (sem LOD, 16 e 16)
+    joints: List[Segment] = []
+    for i, nx, ny in _kept_pairs(frames, lod):
+        sh = ((i + parity) % 2) * 0.5
+        joints.extend(seg for _, seg in _pair_joints(frames[i], frames[i + 1], sh, nx, ny))
+    return joints
+
+
+def _ring_threshold(lod: Optional[LevelOfDetail]) -> float:
+    """Tamanho mínimo (px) de um anel para ser desenhado e ter juntas."""
+    return 50.0 if lod is None else lod.ring_px
+
+
+def joints_array(frames, parity: int = 0, lod: Optional[LevelOfDetail] = None):
+    """Todas as juntas num único cálculo vetorizado, como array (N, 4) (x1, y1, x2, y2)."""
+    f = np.asarray(frames, dtype=np.float64).reshape(-1, 4)
+    a, b = f[:-1], f[1:]
+    x1, y1, x2, y2 = a.T
+    xn1, yn1, xn2, yn2 = b.T
+    # meio tijolo de desfasamento em anéis alternados (running bond)
+    shift = ((np.arange(len(a)) + parity) % 2) * 0.5
+    ring_px = _ring_threshold(lod)
+    keep = (x2 - x1 > ring_px) & (y2 - y1 > ring_px)
+
+    if lod is None:
+        n_max = 16
+        nx = ny = np.full(len(a), 16.0)
+    else:
+        n_max = lod.max_joints
+        nx = np.clip(np.trunc((x2 - x1) / lod.brick_px), lod.min_joints, lod.max_joints)
+        ny = np.clip(np.trunc((y2 - y1) / lod.brick_px), lod.min_joints, lod.max_joints)
+    nn = np.arange(n_max, dtype=np.float64)
+    xx1, xxx1 = ((x2 - x1) / nx)[:, None], ((xn2 - xn1) / nx)[:, None]
+    yy1, yyy1 = ((y2 - y1) / ny)[:, None], ((yn2 - yn1) / ny)[:, None]
+    sh = shift[:, None]
+    # np.trunc reproduz o int() do caminho em Python (valores >= 0)
+    xa = x1[:, None] + np.trunc(xx1 * nn) + xx1 * sh
+    xb = xn1[:, None] + np.trunc(xxx1 * nn) + xxx1 * sh
+    ya = y1[:, None] + np.trunc(yy1 * nn) + yy1 * sh
+    yb = yn1[:, None] + np.trunc(yyy1 * nn) + yyy1 * sh
+
+    col = lambda v: np.broadcast_to(v[:, None], xa.shape)
+    walls = np.stack([
+        np.stack([xa, col(y1), xb, col(yn1)], axis=-1),   # teto
+        np.stack([xa, col(y2), xb, col(yn2)], axis=-1),   # chão
+        np.stack([col(x1), ya, col(xn1), yb], axis=-1),   # parede esquerda
+        np.stack([col(x2), ya, col(xn2), yb], axis=-1),   # parede direita
+    ], axis=2)                                            # (pares, n_max, 4 paredes, 4)
+    # só as juntas que existem: nn < nx no teto/chão e nn < ny nas laterais
+    used = np.stack([nn < nx[:, None]] * 2 + [nn < ny[:, None]] * 2, axis=-1)
+    used &= keep[:, None, None]
+    return walls[used]
+
+
+def tunnel_frames(w: int, h: int, margin: float, depth_layers: int, scale: float,
+                  phase: float = 0.0, lod: Optional[LevelOfDetail] = None) -> List[Rect]:
+    """
+    Retângulos concêntricos do túnel (do mais próximo para o mais fundo).
+    `phase` (em passos de anel) faz os anéis avançar para o observador;
+    a parte fracionária interpola entre camadas, ver phase_parity().
+    Com `lod` a lista termina no primeiro anel abaixo de lod.ring_px ou
+    quando o passo entre anéis fica abaixo de lod.subpixel.
+    """
+    # São no máximo depth_layers passos escalares: a recorrência é barata e é
+    # a referência exata; o trabalho pesado (as juntas) é que é vetorizado.
+    if lod is None:
+        return _frames_py(w, h, margin, depth_layers, scale, phase)
+    return _frames_py(w, h, margin, depth_layers, scale, phase, lod.subpixel, lod.ring_px)
+
+
+def phase_parity(phase: float) -> int:
+    """Paridade do running bond para uma fase: cada passo inteiro troca o meio tijolo."""
+    return int(math.floor(phase)) % 2
+
+
+def visible_rings(frames: List[Rect], min_px: float = 50.0) -> List[Rect]:
+    """Anéis grandes o suficiente para serem desenhados (> min_px em ambos os eixos)."""
+    return [rect for rect in frames if rect[2] - rect[0] > min_px and rect[3] - rect[1] > min_px]
+
+
+def brick_joints(frames: List[Rect], use_numpy: Optional[bool] = None,
+                 parity: int = 0, lod: Optional[LevelOfDetail] = None) -> Joints:
+    """
+    Segmentos das juntas dos tijolos entre cada par de anéis consecutivos.
+    Sem `lod` são sempre 16 juntas por parede; com `lod` o número vem de joint_count().
+    Com NumPy devolve o array (N, 4) tal como sai de joints_array(): o Raster
+    e os ladrilhos usam-no diretamente, e só quem percorre as juntas uma a uma
+    (o canvas, os tijolos) as converte com joint_tuples().
+    """
+    if len(frames) < 2:
+        return []
+    if _use_numpy(use_numpy):
+        return joints_array(frames, parity, lod)
+    return _joints_py(frames, parity, lod)
+
+
+def joint_tuples(joints: Joints) -> List[Segment]:
+    """As juntas como lista de tuplos (a lista do caminho em Python é devolvida tal como está)."""
+    if isinstance(joints, list):
+        return joints
+    return list(map(tuple, joints.tolist()))
+
+
+def _kept_pairs(frames: List[Rect], lod: Optional[LevelOfDetail]):
+    """(i, nx, ny) de cada par de anéis que tem juntas, pela ordem dos kernels."""
+    ring_px = _ring_threshold(lod)
+    for i in range(len(frames) - 1):
+        x1, y1, x2, y2 = frames[i]
+        if not (x2 - x1 > ring_px and y2 - y1 > ring_px):
+            continue
+        if lod is None:
+            yield i, 16, 16
+        else:
+            yield i, joint_count(x2 - x1, lod), joint_count(y2 - y1, lod)
+
+
+def joints_by_pair(frames: List[Rect], joints: Joints,
+                   lod: Optional[LevelOfDetail] = None) -> List[List[Segment]]:
+    """Reparte as juntas de brick_joints() por par de anéis: pairs[i] = juntas entre o anel i e i+1."""
+    pairs: List[List[Segment]] = [[] for _ in range(max(len(frames) - 1, 0))]
+    k = 0
+    for i, nx, ny in _kept_pairs(frames, lod):
+        n = 2 * nx + 2 * ny
+        pairs[i] = joints[k:k + n]
+        k += n
+    return pairs
+
+
+def joint_walls(frames: List[Rect], joints: Joints,
+                lod: Optional[LevelOfDetail] = None) -> List[List[List[Segment]]]:
+    """
+    Reagrupa as juntas de brick_joints() por parede (teto, chão, esquerda,
+    direita) e, dentro de cada parede, por par de anéis: walls[parede][par].
+    """
+    walls: List[List[List[Segment]]] = [[], [], [], []]
+    for _, runs in _pair_walls(frames, joints, lod):
+        for wall in range(4):
+            walls[wall].append(runs[wall])
+    return walls
+
+
+def _pair_walls(frames: List[Rect], joints: Joints,
+                lod: Optional[LevelOfDetail]) -> Iterator[Tuple[int, List[List[Segment]]]]:
+    # (par, runs) de cada par com juntas: runs[parede] = as suas juntas pela ordem ao longo da parede
+    joints = joint_tuples(joints)  # indexar um array linha a linha seria muito mais lento
+    k = 0
+    for i, nx, ny in _kept_pairs(frames, lod):
+        runs: List[List[Segment]] = [[], [], [], []]
+        # mesma ordem dos kernels: por junta nn, teto/chão (nn < nx) e laterais (nn < ny)
+        for nn in range(max(nx, ny)):
+            for wall in ((0, 1) if nn < nx else ()) + ((2, 3) if nn < ny else ()):
+                runs[wall].append(joints[k])
+                k += 1
+        yield i, runs
+
+
+def joint_polylines(frames: List[Rect], joints: Joints,
+                    lod: Optional[LevelOfDetail] = None) -> List[List[float]]:
+    """
+    Uma única polilinha por parede com todas as juntas. Cada junta a->b é
+    percorrida a->b->a e a deslocação até à junta seguinte corre sobre a
+    aresta de um anel que já é desenhado, por isso o resultado visual é o
+    mesmo que com uma linha por junta.
+    """
+    lines = []
+    for runs in joint_walls(frames, joints, lod):
+        pts: List[float] = []
+        for run in runs:
+            for xa, ya, xb, yb in run[:-1]:
+                pts += (xa, ya, xb, yb, xa, ya)
+            if run:
+                # termina no anel seguinte, onde começa o próximo par
+                pts += run[-1]
+        if len(pts) >= 4:
+            lines.append(pts)
+    return lines
+
+
+class BrickIndex:
+    """
+    Índice de tijolos da vista 2D: ponto do ecrã -> (anel, parede, tijolo),
+    sem passar pelos itens do canvas. Os anéis são retângulos encaixados,
+    por isso o anel vem de uma pesquisa binária (O(log n)); são também
+    semelhantes e concêntricos, logo a parede é a da diagonal do anel (O(1))
+    e o tijolo sai de um bisect nas juntas dessa parede (no máximo 16, ou
+    LevelOfDetail.max_joints). O tijolo i fica entre as juntas i-1 e i.
+    """
+
+    def __init__(self, frames: List[Rect], joints: Joints, lod: Optional[LevelOfDetail] = None):
+        self.frames = frames
+        # pares com juntas: walls[parede] = juntas por ordem ao longo da parede
+        self.pairs: Dict[int, List[List[Segment]]] = dict(_pair_walls(frames, joints, lod))
+
+    def locate(self, x: float, y: float) -> Optional[Tuple[int, int, int]]:
+        """(anel, parede, tijolo) sob o ponto, ou None fora das paredes com juntas."""
+        f = self.frames
+        lo, hi = 0, len(f)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            x1, y1, x2, y2 = f[mid]
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                lo = mid + 1
+            else:
+                hi = mid
+        k = lo - 1
+        if k not in self.pairs:
+            return None
+        x1, y1, x2, y2 = f[k]
+        dx = (x - (x1 + x2) / 2) / (x2 - x1)
+        dy = (y - (y1 + y2) / 2) / (y2 - y1)
+        if abs(dy) >= abs(dx):
+            wall = 0 if dy < 0 else 1
+        else:
+            wall = 2 if dx < 0 else 3
+        return k, wall, bisect.bisect_right(self._cuts(k, wall, x, y), x if wall < 2 else y)
+
+    def _cuts(self, k: int, wall: int, x: float, y: float) -> List[float]:
+        # posição de cada junta da parede à profundidade do ponto
+        a, b = self.frames[k], self.frames[k + 1]
+        if wall < 2:
+            ya, yb = (a[1], b[1]) if wall == 0 else (a[3], b[3])
+            t = (y - ya) / (yb - ya) if yb != ya else 0.0
+            return [s[0] + (s[2] - s[0]) * t for s in self.pairs[k][wall]]
+        xa, xb = (a[0], b[0]) if wall == 2 else (a[2], b[2])
+        t = (x - xa) / (xb - xa) if xb != xa else 0.0
+        return [s[1] + (s[3] - s[1]) * t for s in self.pairs[k][wall]]
+
+    def polygon(self, brick: Tuple[int, int, int]) -> Optional[List[float]]:
+        """Contorno do tijolo (4 cantos, x0, y0, ...), ou None se já não existir."""
+        k, wall, i = brick
+        if k not in self.pairs:
+            return None
+        runs = self.pairs[k][wall]
+        if not 0 <= i <= len(runs):
+            return None
+        (ax1, ay1, ax2, ay2), (bx1, by1, bx2, by2) = self.frames[k], self.frames[k + 1]
+        # arestas da parede: do canto inicial ao canto final, de a (fora) para b (dentro)
+        start, end = [((ax1, ay1, bx1, by1), (ax2, ay1, bx2, by1)),
+                      ((ax1, ay2, bx1, by2), (ax2, ay2, bx2, by2)),
+                      ((ax1, ay1, bx1, by1), (ax1, ay2, bx1, by2)),
+                      ((ax2, ay1, bx2, by1), (ax2, ay2, bx2, by2))][wall]
+        left = runs[i - 1] if i > 0 else start
+        right = runs[i] if i < len(runs) else end
+        return [left[0], left[1], right[0], right[1], right[2], right[3], left[2], left[3]]
+
+
+def brick_quads(frames: List[Rect], joints: Joints, lod: Optional[LevelOfDetail] = None
+                ) -> Tuple[List[List[float]], List[int], List[int], List[int]]:
+    """
+    Todos os tijolos como quadriláteros (x0, y0, ..., x3, y3), com o anel, a
+    parede e o índice de cada um (como em BrickIndex). Os pares de anéis sem
+    juntas (pequenos demais) dão uma só faixa por parede, para o preenchimento
+    chegar ao fundo do túnel; o último anel fecha com um retângulo de parede -1
+    (só nevoeiro).
+    """
+    index = BrickIndex(frames, joints, lod)
+    empty: List[List[Segment]] = [[], [], [], []]
+    polys: List[List[float]] = []
+    layers: List[int] = []
+    walls: List[int] = []
+    bricks: List[int] = []
+    for k in range(len(frames) - 1):
+        runs = index.pairs.get(k, empty)
+        for wall in range(4):
+            for i in range(len(runs[wall]) + 1):
+                polys.append(index.polygon((k, wall, i)) if runs is not empty
+                             else _band_polygon(frames[k], frames[k + 1], wall))
+                layers.append(k)
+                walls.append(wall)
+                bricks.append(i)
+    if frames:
+        x1, y1, x2, y2 = frames[-1]
+        polys.append([x1, y1, x2, y1, x2, y2, x1, y2])
+        layers.append(len(frames) - 1)
+        walls.append(-1)
+        bricks.append(0)
+    return polys, layers, walls, bricks
+
+
+def _band_polygon(a: Rect, b: Rect, wall: int) -> List[float]:
+    # a parede inteira entre os anéis a e b (trapézio entre as diagonais)
+    (ax1, ay1, ax2, ay2), (bx1, by1, bx2, by2) = a, b
+    return [[ax1, ay1, ax2, ay1, bx2, by1, bx1, by1],
+            [ax1, ay2, ax2, ay2, bx2, by2, bx1, by2],
+            [ax1, ay1, ax1, ay2, bx1, by2, bx1, by1],
+            [ax2, ay1, ax2, ay2, bx2, by2, bx2, by1]][wall]
+
+
+class BrickShading(NamedTuple):
+    """Cor dos tijolos: luz por parede, variação entre tijolos vizinhos e nevoeiro com a profundidade."""
+    brick: str = "#B5562F"
+    fog: str = "#1A0F08"         # cor para onde tende o fundo do túnel
+    fog_density: float = 0.08    # por anel: cor = fog + (tijolo - fog) * exp(-fog_density * k)
+    walls: Tuple[float, float, float, float] = (0.75, 1.0, 0.9, 0.8)  # teto, chão, esquerda, direita
+    variation: float = 0.08      # tijolos alternados um pouco mais claros/escuros
+
+
+def brick_colors(layers: Sequence[int], walls: Sequence[int], bricks: Sequence[int],
+                 shading: BrickShading = BrickShading(), use_numpy: Optional[bool] = None):
+    """
+    Cor RGB de cada tijolo numa só passagem (vetorizada com NumPy: array
+    (N, 3) uint8; sem NumPy, lista de tuplos). Parede -1 é só nevoeiro.
+    """
+    base, fog = _rgb(shading.brick), _rgb(shading.fog)
+    if _use_numpy(use_numpy):
+        k = np.asarray(layers, dtype=np.float64)
+        alt = (np.asarray(layers) + np.asarray(bricks)) % 2 * 2 - 1
+        wall = np.asarray(walls, dtype=np.intp).reshape(-1)
+        light = np.asarray(shading.walls)[wall] * (1 + shading.variation * alt)
+        f = np.where(wall < 0, 0.0, np.exp(-shading.fog_density * k))[:, None]
+        lit = np.minimum(np.asarray(base, dtype=np.float64) * light[:, None], 255.0)
+        return np.rint(np.asarray(fog) + (lit - np.asarray(fog)) * f).astype(np.uint8).reshape(-1, 3)
+    out = []
+    for k, wall, i in zip(layers, walls, bricks):
+        light = shading.walls[wall] * (1 + shading.variation * ((k + i) % 2 * 2 - 1))
+        f = math.exp(-shading.fog_density * k) if wall >= 0 else 0.0
+        out.append(tuple(int(round(g + (min(c * light, 255.0) - g) * f)) for c, g in zip(base, fog)))
+    return out
+
+
+class RingCmd(NamedTuple):
+    """Comando de desenho: contorno do anel `layer`."""
+    layer: int
+    rect: Rect
+    width: int
+
+
+class JointCmd(NamedTuple):
+    """Comando de desenho: junta entre os anéis `layer` e `layer`+1, na parede `wall` (0-3)."""
+    layer: int
+    wall: int
+    seg: Segment
+    width: int
+
+
+DrawCmd = Union[RingCmd, JointCmd]
+
+
+def iter_draw_commands(w: int, h: int, margin: float, depth_layers: int, scale: float,
+                       phase: float = 0.0, lod: Optional[LevelOfDetail] = None,
+                       line_width: int = 2) -> Iterator[DrawCmd]:
+    """
+    A cena como um fluxo preguiçoso de comandos (anel k, juntas do par k, anel
+    k+1, ...). Cada anel é calculado só quando é preciso, por isso um backend
+    pode começar a desenhar logo e a memória não cresce com a profundidade.
+    Produz a mesma geometria que scene_geometry(), noutra ordem.
+    """
+    ring_px = _ring_threshold(lod)
+    parity = phase_parity(phase)
+    jw = max(1, line_width-1)
+    frames = iter_frames(w, h, margin, depth_layers, scale, phase,
+                         *((0.0, 0.0) if lod is None else (lod.subpixel, lod.ring_px)))
+    prev = next(frames, None)
+    k = 0
+    for rect in frames:
+        x1, y1, x2, y2 = prev
+        if x2 - x1 > ring_px and y2 - y1 > ring_px:
+            yield RingCmd(k, prev, line_width)
+            if lod is None:
+                nx = ny = 16
+            else:
+                nx, ny = joint_count(x2 - x1, lod), joint_count(y2 - y1, lod)
+            for wall, seg in _pair_joints(prev, rect, ((k + parity) % 2) * 0.5, nx, ny):
+                yield JointCmd(k, wall, seg, jw)
+        prev = rect
+        k += 1
+    # o último anel só conta se houver pelo menos dois (como em redraws)
+    if k and prev[2] - prev[0] > ring_px and prev[3] - prev[1] > ring_px:
+        yield RingCmd(k, prev, line_width)
+
+
+class Scene:
+    """
+    Cena compacta: todos os anéis e juntas em buffers contíguos array('d')
+    (4 doubles por primitiva), com um índice de estilo por primitiva e
+    offsets por camada, para fatiar um intervalo de camadas sem cópia
+    (memoryview). Ocupa uma fração da memória das listas de tuplos.
+    """
+
+    def __init__(self, styles: Sequence[Tuple[int, str]] = ((2, "black"), (1, "black"))):
+        self.styles: List[Tuple[int, str]] = list(styles)   # (espessura, cor)
+        self.rings = array("d")          # x1, y1, x2, y2 do anel k em [4k:4k+4]
+        self.ring_style = array("B")
+        self.joints = array("d")         # x1, y1, x2, y2 de cada junta
+        self.joint_style = array("B")
+        self.joint_wall = array("B")     # 0 teto, 1 chão, 2 esquerda, 3 direita
+        self.joint_offsets = array("I", [0])  # juntas do par k: [offsets[k]:offsets[k+1]]
+
+    @classmethod
+    def build(cls, commands: Iterable[DrawCmd]) -> "Scene":
+        """Constrói a cena a partir de iter_draw_commands(), sem listas intermédias."""
+        scene = cls()
+        style_of = {(w, c): i for i, (w, c) in enumerate(scene.styles)}
+
+        def style(width: int) -> int:
+            if (width, "black") not in style_of:
+                style_of[(width, "black")] = len(scene.styles)
+                scene.styles.append((width, "black"))
+            return style_of[(width, "black")]
+
+        for cmd in commands:
+            if isinstance(cmd, RingCmd):
+                scene.rings.extend(cmd.rect)
+                scene.ring_style.append(style(cmd.width))
+            else:
+                # fecha os pares anteriores (sem juntas) até chegar ao par desta junta
+                while len(scene.joint_offsets) <= cmd.layer + 1:
+                    scene.joint_offsets.append(len(scene.joint_style))
+                scene.joints.extend(cmd.seg)
+                scene.joint_style.append(style(cmd.width))
+                scene.joint_wall.append(cmd.wall)
+                scene.joint_offsets[cmd.layer + 1] = len(scene.joint_style)
+        return scene
+
+    @property
+    def ring_count(self) -> int:
+        return len(self.ring_style)
+
+    @property
+    def joint_count(self) -> int:
+        return len(self.joint_style)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(a) * a.itemsize for a in (self.rings, self.ring_style, self.joints,
+                                                  self.joint_style, self.joint_wall, self.joint_offsets))
+
+    def layer_rings(self, start: int, stop: int) -> memoryview:
+        """Anéis das camadas start..stop-1 (4 doubles cada), sem cópia."""
+        return memoryview(self.rings)[4 * start:4 * min(stop, self.ring_count)]
+
+    def layer_joints(self, start: int, stop: int) -> memoryview:
+        """Juntas dos pares start..stop-1 (4 doubles cada), sem cópia."""
+        last = len(self.joint_offsets) - 1
+        a = self.joint_offsets[min(start, last)]
+        b = self.joint_offsets[min(stop, last)]
+        return memoryview(self.joints)[4 * a:4 * b]
+
+    def as_arrays(self):
+        """Vistas NumPy (N, 4) dos anéis e das juntas, sem cópia."""
+        return (np.frombuffer(self.rings, dtype=np.float64).reshape(-1, 4),
+                np.frombuffer(self.joints, dtype=np.float64).reshape(-1, 4))
+
+    def to_lists(self) -> Tuple[List[Rect], List[Segment]]:
+        """Anéis e juntas como listas de tuplos (para as APIs que as esperam)."""
+        r, j = self.rings, self.joints
+        return ([tuple(r[i:i + 4]) for i in range(0, len(r), 4)],
+                [tuple(j[i:i + 4]) for i in range(0, len(j), 4)])
+
+    def draw(self, raster: "Raster", start: int = 0, stop: Optional[int] = None) -> None:
+        """Rasteriza as camadas start..stop-1, agrupando por estilo."""
+        stop = self.ring_count + 1 if stop is None else stop
+        groups: Dict[int, List[Segment]] = {}
+        r0, r1 = start, min(stop, self.ring_count)
+        rv = self.layer_rings(start, stop)
+        for i in range(r1 - r0):
+            groups.setdefault(self.ring_style[r0 + i], []).extend(rect_segments((tuple(rv[4 * i:4 * i + 4]),)))
+        last = len(self.joint_offsets) - 1
+        j0 = self.joint_offsets[min(start, last)]
+        jv = self.layer_joints(start, stop)
+        for i in range(len(jv) // 4):
+            groups.setdefault(self.joint_style[j0 + i], []).append(tuple(jv[4 * i:4 * i + 4]))
+        for style, segs in groups.items():
+            width, color = self.styles[style]
+            raster.lines(segs, width, color)
+
+
+def canvas_draw_commands(canvas, commands: Iterable[DrawCmd]) -> int:
+    """Cria os itens do canvas à medida que os comandos chegam (etiquetas L<k>/J<k>); devolve o nº de itens."""
+    n = 0
+    for cmd in commands:
+        if isinstance(cmd, RingCmd):
+            canvas.create_rectangle(*cmd.rect, outline="black", width=cmd.width,
+                                    tags=("ring", "L%d" % cmd.layer))
+        else:
+            canvas.create_line(*cmd.seg, width=cmd.width, fill="black",
+                               tags=("joint", "J%d" % cmd.layer))
+        n += 1
+    return n
+
+
+def scene_geometry(w: int, h: int, margin: float, depth_layers: int, scale: float,
+                   phase: float = 0.0, lod: Optional[LevelOfDetail] = None,
+                   use_numpy: Optional[bool] = None) -> Tuple[List[Rect], Joints]:
+    """Anéis a desenhar e juntas de uma cena completa."""
+    frames = tunnel_frames(w, h, margin, depth_layers, scale, phase, lod)
+    if len(frames) < 2:
+        return [], []
+    rings = visible_rings(frames, _ring_threshold(lod))
+    return rings, brick_joints(frames, use_numpy, phase_parity(phase), lod)
+
+
+class GeometryCache:
+    """
+    Cache LRU da geometria já calculada (anéis + juntas), indexada pelos
+    parâmetros que de facto a alteram. maxsize <= 0 desliga a cache.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[tuple, Tuple[List[Rect], Joints]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: tuple, compute) -> Tuple[List[Rect], List[Segment]]:
+        """Devolve a geometria de `key`, calculando-a com compute() se não estiver em cache."""
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        value = compute()
+        if self.maxsize > 0:
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data),
+                "maxsize": self.maxsize, "hit_rate": self.hits / total if total else 0.0}
+
+
+
+def _geometry_nbytes(frames: List[Rect], rings: List[Rect], joints: List[Segment]) -> int:
+    """Memória aproximada de listas de tuplos de 4 floats (rings partilha os tuplos de frames)."""
+    per = sys.getsizeof((0.0,) * 4) + 4 * sys.getsizeof(0.0)
+    return (sys.getsizeof(frames) + sys.getsizeof(rings) + sys.getsizeof(joints)
+            + (len(frames) + len(joints)) * per)
+
+
+class LoopCache:
+    """
+    Um período do voo pelo túnel pré-calculado. A cena é auto-semelhante:
+    avançar a fase 1.0 é avançar um anel, mas a paridade do running bond
+    também troca, por isso a imagem só se repete ao fim de PERIOD = 2.0.
+    O período é dividido em `count` frames (slots, um por frame de animação)
+    que depois são apenas percorridos. Cada frame guardado conta em nbytes;
+    acima de max_frames ou de max_bytes os restantes slots são calculados
+    sem ficar em cache (count não é limitado por max_frames).
+    """
+
+    PERIOD = 2.0
+
+    def __init__(self, max_frames: int = 120, max_bytes: int = 256 << 20):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self.count = 0
+        self._key = None
+        self._data: Dict[int, object] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def configure(self, key: tuple, count: int) -> None:
+        """Fixa o estado (tamanho, parâmetros) e o nº de frames por período; se mudarem, esvazia."""
+        count = max(1, count)
+        if key != self._key or count != self.count:
+            self.clear()
+            self._key, self.count = key, count
+
+    def slot(self, phase: float) -> int:
+        """Slot mais próximo de `phase`."""
+        return int(round(phase % self.PERIOD / self.PERIOD * self.count)) % self.count
+
+    def phase(self, slot: int) -> float:
+        return slot * self.PERIOD / self.count
+
+    def get(self, slot: int, compute: Callable[[], Tuple[object, int]]):
+        """Frame do slot; compute() devolve (frame, bytes) e só é chamado na primeira volta."""
+        if slot in self._data:
+            self.hits += 1
+            return self._data[slot]
+        self.misses += 1
+        value, size = compute()
+        if len(self._data) < self.max_frames and self.nbytes + size <= self.max_bytes:
+            self._data[slot] = value
+            self.nbytes += size
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "frames": len(self._data),
+                "count": self.count, "max_frames": self.max_frames,
+                "nbytes": self.nbytes, "max_bytes": self.max_bytes}
+
+_NAMED_COLORS = {"black": (0, 0, 0), "white": (255, 255, 255)}
+
+
+def _rgb(color) -> Tuple[int, int, int]:
+    """Converte "#RRGGBB" (ou um nome simples) para um tuplo (r, g, b)."""
+    if isinstance(color, tuple):
+        return color
+    if color.startswith("#") and len(color) == 7:
+        return int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16)
+    return _NAMED_COLORS[color.lower()]
+
+
+def rect_segments(rects) -> List[Segment]:
+    """As 4 arestas de cada retângulo (x1, y1, x2, y2) como segmentos."""
+    segs: List[Segment] = []
+    for x1, y1, x2, y2 in rects:
+        segs += [(x1, y1, x2, y1), (x2, y1, x2, y2), (x2, y2, x1, y2), (x1, y2, x1, y1)]
+    return segs
+
+
+class Raster:
+    """
+    Buffer RGB em memória (bytearray, 3 bytes por pixel) onde se rasterizam
+    os anéis e as juntas. Com NumPy as linhas são todas rasterizadas de uma
+    vez; sem NumPy usa-se um DDA simples com escrita por fatias.
+
+    Também pode ser uma janela (ladrilho) sobre um buffer maior: `buf` é o
+    buffer da imagem completa com `stride` pixels por linha e (x0, y0) é o
+    canto do ladrilho. As coordenadas de desenho são sempre as da imagem.
+    """
+
+    def __init__(self, w: int, h: int, bg="#FFD300", use_numpy: Optional[bool] = None,
+                 buf=None, x0: int = 0, y0: int = 0, stride: Optional[int] = None):
+        self.w, self.h = w, h
+        self.bg = _rgb(bg)
+        self.use_numpy = _use_numpy(use_numpy)
+        self.x0, self.y0 = x0, y0
+        self.stride = w if stride is None else stride
+        self.buf = bytearray(bytes(self.bg) * (w * h)) if buf is None else buf
+
+    def clear(self) -> None:
+        if self.stride != self.w or self.x0 or self.y0:  # ladrilho: só a sua área
+            color = bytes(self.bg)
+            for y in range(self.y0, self.y0 + self.h):
+                self._span(y, self.x0, self.x0 + self.w, color)
+        else:
+            self.buf[:] = bytes(self.bg) * (self.w * self.h)
+
+    def pixels(self):
+        """Vista NumPy (h, w, 3) sobre o buffer (sem cópia)."""
+        return np.ndarray((self.h, self.w, 3), dtype=np.uint8, buffer=self.buf,
+                          offset=(self.y0 * self.stride + self.x0) * 3,
+                          strides=(self.stride * 3, 3, 1))
+
+    def to_ppm(self) -> bytes:
+        """Imagem em formato PPM binário (P6), que o Tk PhotoImage lê diretamente."""
+        return b"P6 %d %d 255\n" % (self.w, self.h) + bytes(self.buf)
+
+    def to_png(self, level: int = 6) -> bytes:
+        """Imagem em PNG (RGB 8 bits), só com zlib da biblioteca padrão."""
+        stride = self.w * 3
+        raw = bytearray()
+        for y in range(self.h):
+            raw += b"\x00"  # filtro "None" em cada linha
+            raw += self.buf[y * stride:(y + 1) * stride]
+
+        def chunk(tag: bytes, data: bytes) -> bytes:
+            return (struct.pack(">I", len(data)) + tag + data
+                    + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+        return (b"\x89PNG\r\n\x1a\n"
+                + chunk(b"IHDR", struct.pack(">IIBBBBB", self.w, self.h, 8, 2, 0, 0, 0))
+                + chunk(b"IDAT", zlib.compress(bytes(raw), level))
+                + chunk(b"IEND", b""))
+
+    def rects(self, rects, width: int = 1, color="black") -> None:
+        """Contornos de retângulos (x1, y1, x2, y2)."""
+        self.lines(rect_segments(rects), width, color)
+
+    def fill_polygons(self, polys, colors) -> None:
+        """
+        Preenche polígonos convexos (x0, y0, x1, y1, ...) por scanline, cada um
+        com a sua cor (r, g, b). Um pixel é pintado se o seu centro estiver
+        dentro (regra topo-esquerda: vizinhos que partilham uma aresta não se sobrepõem).
+        """
+        if self.use_numpy:
+            self._fill_np(polys, colors)
+            return
+        for poly, color in zip(polys, colors):
+            pts = list(zip(poly[::2], poly[1::2]))
+            edges = list(zip(pts, pts[1:] + pts[:1]))
+            c = bytes(color)
+            ys = poly[1::2]
+            for y in range(max(math.ceil(min(ys) - 0.5), self.y0),
+                           min(math.ceil(max(ys) - 0.5), self.y0 + self.h)):
+                yc = y + 0.5
+                xs = [ax + (yc - ay) * (bx - ax) / (by - ay) for (ax, ay), (bx, by) in edges
+                      if (ay <= yc < by) or (by <= yc < ay)]
+                if xs:
+                    self._span(y, math.ceil(min(xs) - 0.5), math.ceil(max(xs) - 0.5), c)
+
+    def _fill_np(self, polys, colors) -> None:
+        p = np.asarray(polys, dtype=np.float64)
+        if not len(p):
+            return
+        p = p.reshape(len(p), -1, 2)
+        col = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+        # uma linha por (polígono, scanline), todas num só array
+        ys = p[:, :, 1]
+        ya = np.clip(np.ceil(ys.min(1) - 0.5), self.y0, self.y0 + self.h).astype(np.int64)
+        yb = np.clip(np.ceil(ys.max(1) - 0.5), self.y0, self.y0 + self.h).astype(np.int64)
+        n = np.maximum(yb - ya, 0)
+        poly = np.repeat(np.arange(len(p)), n)
+        y = np.repeat(ya, n) + (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n))
+        a = p[poly]
+        b = np.roll(a, -1, axis=1)
+        yc = (y + 0.5)[:, None]
+        ay, by = a[..., 1], b[..., 1]
+        cross = ((ay <= yc) & (yc < by)) | ((by <= yc) & (yc < ay))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = a[..., 0] + (yc - ay) * (b[..., 0] - a[..., 0]) / (by - ay)
+        left = np.where(cross, x, np.inf).min(1)
+        right = np.where(cross, x, -np.inf).max(1)
+        ok = np.isfinite(left) & np.isfinite(right)
+        xa = np.clip(np.ceil(left[ok] - 0.5), self.x0, self.x0 + self.w).astype(np.int64)
+        xb = np.clip(np.ceil(right[ok] - 0.5), self.x0, self.x0 + self.w).astype(np.int64)
+        y, poly = y[ok], poly[ok]
+        # e um pixel por ponto de cada span
+        k = np.maximum(xb - xa, 0)
+        xs = np.repeat(xa, k) + (np.arange(k.sum()) - np.repeat(np.cumsum(k) - k, k))
+        # cópia de 3 bytes por pixel (dtype "V3") em vez de três canais uint8
+        out = np.frombuffer(self.buf, dtype="V3")
+        out[np.repeat(y * self.stride, k) + xs] = col.view("V3").ravel()[np.repeat(poly, k)]
+
+    def lines(self, segs, width: int = 1, color="black") -> None:
+        """Segmentos (x1, y1, x2, y2) com pincel quadrado de `width` pixels."""
+        rgb = _rgb(color)
+        if self.use_numpy:
+            self._lines_np(segs, width, rgb)
+        else:
+            for x0, y0, x1, y1 in segs:
+                self._line_py(x0, y0, x1, y1, width, rgb)
+
+    def draw_commands(self, commands: Iterable[DrawCmd], color="black", chunk: int = 4096) -> None:
+        """Consome um fluxo de comandos, rasterizando em lotes de `chunk` segmentos."""
+        batches: Dict[int, List[Segment]] = {}
+        for cmd in commands:
+            batch = batches.setdefault(cmd.width, [])
+            if isinstance(cmd, RingCmd):
+                batch += rect_segments((cmd.rect,))
+            else:
+                batch.append(cmd.seg)
+            if len(batch) >= chunk:
+                self.lines(batch, cmd.width, color)
+                batch.clear()
+        for width, batch in batches.items():
+            self.lines(batch, width, color)
+
+    def _span(self, y: int, xa: int, xb: int, color: bytes) -> None:
+        # pinta a linha y de xa (inclusive) a xb (exclusive), recortada à imagem
+        if y < self.y0 or y >= self.y0 + self.h:
+            return
+        xa, xb = max(xa, self.x0), min(xb, self.x0 + self.w)
+        if xa < xb:
+            o = y * self.stride
+            self.buf[(o + xa) * 3:(o + xb) * 3] = color * (xb - xa)
+
+    def _line_py(self, x0, y0, x1, y1, width, rgb) -> None:
+        r = width // 2
+        color = bytes(rgb)
+        ya, yb = math.floor(y0 + 0.5), math.floor(y1 + 0.5)
+        if ya == yb:  # horizontal: uma fatia por linha do pincel
+            xa, xb = sorted((math.floor(x0 + 0.5), math.floor(x1 + 0.5)))
+            for y in range(ya - r, ya - r + width):
+                self._span(y, xa - r, xb - r + width, color)
+            return
+        # ceil: passo <= 1 px, para não saltar pixels
+        n = math.ceil(max(abs(x1 - x0), abs(y1 - y0))) + 1
+        for i in range(n):
+            t = i / (n - 1) if n > 1 else 0.0
+            x = math.floor(x0 + (x1 - x0) * t + 0.5) - r
+            y = math.floor(y0 + (y1 - y0) * t + 0.5) - r
+            for yy in range(y, y + width):
+                self._span(yy, x, x + width, color)
+
+    def _lines_np(self, segs, width, rgb) -> None:
+        s = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+        if not len(s):
+            return
+        x0, y0, x1, y1 = s.T
+        # DDA em lote: n pontos por segmento, todos os segmentos num só array
+        n = np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))).astype(np.int64) + 1
+        seg = np.repeat(np.arange(len(s)), n)
+        i = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        t = i / np.maximum(n - 1, 1)[seg]
+        px = np.floor(x0[seg] + (x1 - x0)[seg] * t + 0.5).astype(np.int64)
+        py = np.floor(y0[seg] + (y1 - y0)[seg] * t + 0.5).astype(np.int64)
+        img = self.pixels()
+        px -= self.x0
+        py -= self.y0
+        r = width // 2
+        for oy in range(-r, width - r):
+            for ox in range(-r, width - r):
+                xs, ys = px + ox, py + oy
+                m = (xs >= 0) & (xs < self.w) & (ys >= 0) & (ys < self.h)
+                img[ys[m], xs[m]] = rgb
+
+
+def draw_raster(raster: Raster, rings: List[Rect], joints: Joints, line_width: int,
+                bricks=None) -> None:
+    """
+    Desenha anéis e juntas num Raster, com as mesmas espessuras do canvas;
+    `bricks` = (polígonos, cores) são preenchidos primeiro, por baixo das linhas.
+    """
+    if bricks is not None:
+        raster.fill_polygons(*bricks)
+    raster.rects(rings, line_width)
+    raster.lines(joints, max(1, line_width-1))
+
+
+# Exportação vetorial: cada grupo (os anéis, e as juntas de cada parede) vira
+# um único caminho. Os comandos são percorridos uma vez por grupo, a partir de
+# uma fábrica de iteradores, para escrever tudo em fluxo sem guardar a cena.
+_VECTOR_GROUPS = (-1, 0, 1, 2, 3)  # -1: anéis; 0..3: juntas de cima, baixo, esquerda, direita
+_EPS_FLUSH = 1000  # subcaminhos por stroke (limite prático de alguns interpretadores PostScript)
+
+
+def _vector_group(make_commands: Callable[[], Iterable[DrawCmd]], group: int) -> Iterator[DrawCmd]:
+    for cmd in make_commands():
+        if isinstance(cmd, RingCmd):
+            if group < 0:
+                yield cmd
+        elif cmd.wall == group:
+            yield cmd
+
+
+def write_svg(path: str, w: int, h: int, make_commands: Callable[[], Iterable[DrawCmd]],
+              bg="#FFD300") -> None:
+    """
+    Grava a cena como SVG em fluxo: um <path> com todos os anéis e um <path>
+    por parede com todas as suas juntas, em vez de um elemento por primitiva.
+    `make_commands` devolve um iterador novo de comandos a cada chamada.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">\n' % (w, h))
+        f.write('<rect width="100%%" height="100%%" fill="%s"/>\n' % bg)
+        f.write('<g fill="none" stroke="black">\n')
+        for group in _VECTOR_GROUPS:
+            opened = False
+            for cmd in _vector_group(make_commands, group):
+                if not opened:
+                    f.write('<path stroke-width="%d" d="' % cmd.width)
+                    opened = True
+                if group < 0:
+                    x1, y1, x2, y2 = cmd.rect
+                    f.write("M%.2f %.2fH%.2fV%.2fH%.2fZ\n" % (x1, y1, x2, y2, x1))
+                else:
+                    f.write("M%.2f %.2fL%.2f %.2f\n" % cmd.seg)
+            if opened:
+                f.write('"/>\n')
+        f.write("</g>\n</svg>\n")
+
+
+def write_eps(path: str, w: int, h: int, make_commands: Callable[[], Iterable[DrawCmd]],
+              bg="#FFD300") -> None:
+    """
+    Grava a cena como EPS em fluxo, sem passar por canvas.postscript: um
+    caminho por grupo (anéis, juntas de cada parede) com moveto/lineto,
+    traçado de _EPS_FLUSH em _EPS_FLUSH subcaminhos.
+    """
+    r, g, b = _rgb(bg)
+    with open(path, "w", encoding="ascii") as f:
+        f.write("%%!PS-Adobe-3.0 EPSF-3.0\n%%%%BoundingBox: 0 0 %d %d\n%%%%EndComments\n" % (w, h))
+        f.write("/m {moveto} bind def /l {lineto} bind def /s {stroke} bind def\n")
+        f.write("%.4f %.4f %.4f setrgbcolor 0 0 %d %d rectfill\n" % (r / 255, g / 255, b / 255, w, h))
+        # coordenadas do canvas: origem no canto superior esquerdo, y para baixo
+        f.write("0 %d translate 1 -1 scale 0 setgray 0 setlinejoin 0 setlinecap\n" % h)
+        for group in _VECTOR_GROUPS:
+            n = 0
+            for cmd in _vector_group(make_commands, group):
+                if not n:
+                    f.write("%d setlinewidth\n" % cmd.width)
+                if group < 0:
+                    x1, y1, x2, y2 = cmd.rect
+                    f.write("%.2f %.2f m %.2f %.2f l %.2f %.2f l %.2f %.2f l closepath\n"
+                            % (x1, y1, x2, y1, x2, y2, x1, y2))
+                else:
+                    f.write("%.2f %.2f m %.2f %.2f l\n" % cmd.seg)
+                n += 1
+                if n % _EPS_FLUSH == 0:
+                    f.write("s\n")
+            if n % _EPS_FLUSH:
+                f.write("s\n")
+        f.write("showpage\n%%EOF\n")
+
+
+# ---------------------------------------------------------------------------
+# Câmara 3D: o túnel como geometria no espaço (anel k em z = k * spacing) e
+# uma projeção em perspetiva com posição, yaw/pitch e FOV. A geometria do
+# mundo não depende da câmara, por isso é calculada uma vez e só a projeção
+# (vetorizada com NumPy) é refeita quando a câmara se move.
+# ---------------------------------------------------------------------------
+
+class Camera(NamedTuple):
+    """Câmara em coordenadas do mundo (y para cima, olha para +z); ângulos em graus."""
+    x: float = 0.0
+    y: float = 0.0
+    z: float = -1.1
+    yaw: float = 0.0    # positivo = virar para a direita
+    pitch: float = 0.0  # positivo = olhar para cima
+    fov: float = 90.0   # campo de visão vertical
+    near: float = 0.05  # plano de recorte próximo
+
+
+Vec3 = Tuple[float, float, float]
+
+
+class TunnelWorld(NamedTuple):
+    """
+    Segmentos 3D (x1, y1, z1, x2, y2, z2) do túnel, com o anel e a parede de
+    cada um (-1 = aresta de anel), e o referencial de cada anel (centro,
+    direita, cima, frente): os cantos são centro +/- half_w*direita +/- half_h*cima.
+    Os segmentos estão agrupados por anel, por ordem.
+    """
+    segs: object  # array (N, 6) com NumPy, senão lista de tuplos
+    layers: List[int]
+    walls: List[int]
+    rings: List[Tuple[Vec3, Vec3, Vec3, Vec3]]
+    half: Tuple[float, float]
+    offsets: List[int]  # primeiro segmento de cada anel (e o total no fim)
+
+
+class TunnelPath:
+    """
+    Eixo curvo do túnel: uma spline Catmull-Rom pelos pontos de controlo,
+    reamostrada uma única vez a passos iguais de comprimento de arco
+    (spacing / samples_per_ring). Cada amostra guarda o seu referencial
+    (centro, direita, cima, frente), sem rotação em torno do eixo (a
+    "direita" fica sempre horizontal), por isso pose(s) é só uma consulta
+    à tabela com interpolação linear.
+    """
+
+    def __init__(self, points: Sequence[Vec3], spacing: float = 1.0, samples_per_ring: int = 8,
+                 steps: int = 64):
+        if len(points) < 2:
+            raise ValueError("a spline precisa de pelo menos 2 pontos")
+        self.spacing = spacing
+        self.ds = spacing / samples_per_ring
+        pts = [tuple(map(float, p)) for p in points]
+        # pontos fantasma nas pontas: tangente natural no início e no fim
+        ctrl = [_lerp3(pts[1], pts[0], 2.0)] + pts + [_lerp3(pts[-2], pts[-1], 2.0)]
+        dense = [pts[0]]
+        for i in range(1, len(ctrl) - 2):
+            p0, p1, p2, p3 = ctrl[i - 1:i + 3]
+            for n in range(1, steps + 1):
+                t = n / steps
+                dense.append(tuple(0.5 * (2 * p1[j] + (p2[j] - p0[j]) * t
+                                          + (2 * p0[j] - 5 * p1[j] + 4 * p2[j] - p3[j]) * t * t
+                                          + (3 * p1[j] - p0[j] - 3 * p2[j] + p3[j]) * t * t * t)
+                                   for j in range(3)))
+        # comprimento acumulado e reamostragem a passo constante ds
+        acc = [0.0]
+        for p, q in zip(dense, dense[1:]):
+            acc.append(acc[-1] + math.dist(p, q))
+        self.length = acc[-1]
+        self.centers: List[Vec3] = []
+        j = 0
+        for n in range(int(self.length / self.ds) + 1):
+            s = n * self.ds
+            while j + 2 < len(acc) and acc[j + 1] < s:
+                j += 1
+            seg = acc[j + 1] - acc[j]
+            self.centers.append(_lerp3(dense[j], dense[j + 1], (s - acc[j]) / seg if seg else 0.0))
+        c = self.centers
+        self.frames = []
+        for i in range(len(c)):
+            p, q = c[max(i - 1, 0)], c[min(i + 1, len(c) - 1)]
+            self.frames.append((c[i],) + _path_basis((q[0] - p[0], q[1] - p[1], q[2] - p[2])))
+
+    @classmethod
+    def wavy(cls, length: float = 200.0, amplitude: Tuple[float, float] = (4.0, 2.0),
+             wavelength: float = 40.0, spacing: float = 1.0) -> "TunnelPath":
+        """Um caminho de demonstração que serpenteia em x e em y ao longo de z."""
+        n = max(2, int(length / (wavelength / 4)) + 1)
+        pts = [(amplitude[0] * math.sin(2 * math.pi * z / wavelength),
+                amplitude[1] * math.sin(math.pi * z / wavelength), z)
+               for z in (length * i / (n - 1) for i in range(n))]
+        return cls(pts, spacing)
+
+    def pose(self, s: float) -> Tuple[Vec3, Vec3, Vec3, Vec3]:
+        """(centro, direita, cima, frente) à distância s; fora do caminho prolonga as pontas em linha reta."""
+        last = len(self.centers) - 1
+        x = s / self.ds
+        if x <= 0 or x >= last:
+            i = 0 if x <= 0 else last
+            c, r, u, f = self.frames[i]
+            d = s - i * self.ds
+            return (c[0] + f[0] * d, c[1] + f[1] * d, c[2] + f[2] * d), r, u, f
+        i = int(x)
+        t = x - i
+        (ca, _, _, fa), (cb, _, _, fb) = self.frames[i], self.frames[i + 1]
+        return (_lerp3(ca, cb, t),) + _path_basis(_lerp3(fa, fb, t))
+
+    def camera(self, cam: Camera, s: float) -> Camera:
+        """
+        Câmara no referencial do caminho: (cam.x, cam.y) é o desvio lateral,
+        s a distância ao longo do caminho e yaw/pitch são relativos à direção do túnel.
+        """
+        c, r, u, f = self.pose(s)
+        return cam._replace(x=c[0] + cam.x * r[0] + cam.y * u[0], y=c[1] + cam.x * r[1] + cam.y * u[1],
+                            z=c[2] + cam.x * r[2] + cam.y * u[2],
+                            yaw=cam.yaw + math.degrees(math.atan2(f[0], f[2])),
+                            pitch=cam.pitch + math.degrees(math.asin(max(-1.0, min(1.0, f[1])))))
+
+
+def _lerp3(a: Vec3, b: Vec3, t: float) -> Vec3:
+    return (a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t, a[2] + (b[2] - a[2]) * t)
+
+
+def _path_basis(d: Vec3) -> Tuple[Vec3, Vec3, Vec3]:
+    # (direita, cima, frente) com frente na direção d e direita horizontal
+    n = math.sqrt(d[0] ** 2 + d[1] ** 2 + d[2] ** 2) or 1.0
+    f = (d[0] / n, d[1] / n, d[2] / n)
+    n = math.hypot(f[0], f[2])
+    r = (f[2] / n, 0.0, -f[0] / n) if n > 1e-12 else (1.0, 0.0, 0.0)  # frente vertical: direita em x
+    u = (f[1] * r[2] - f[2] * r[1], f[2] * r[0] - f[0] * r[2], f[0] * r[1] - f[1] * r[0])
+    return r, u, f
+
+
+def tunnel_world(depth_layers: int, spacing: float = 1.0, half_w: float = 1.5, half_h: float = 1.0,
+                 joints: int = 16, use_numpy: Optional[bool] = None,
+                 path: Optional[TunnelPath] = None) -> TunnelWorld:
+    """
+    Anéis retangulares (2*half_w x 2*half_h) a cada `spacing` e, entre cada
+    par, `joints` juntas por parede a ligar pontos homólogos dos dois anéis,
+    desfasadas meio tijolo em pares alternados (running bond), como em
+    _pair_joints(). Sem `path` os anéis estão em z = k * spacing; com `path`
+    o centro e a orientação de cada anel vêm do caminho (e depth_layers é
+    limitado ao comprimento deste).
+    """
+    if path is None:
+        rings = [((0.0, 0.0, k * spacing), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+                 for k in range(depth_layers)]
+    else:
+        rings = [path.pose(k * spacing) for k in range(min(depth_layers, int(path.length / spacing) + 1))]
+    segs: List[Tuple[float, ...]] = []
+    layers: List[int] = []
+    walls: List[int] = []
+    offsets = [0]
+    corners = [_ring_corners(ring, (half_w, half_h)) for ring in rings]
+    for k, (tl, tr, br, bl) in enumerate(corners):
+        # arestas do anel: teto, chão, esquerda, direita
+        segs += [tl + tr, bl + br, tl + bl, tr + br]
+        layers += [k] * 4
+        walls += [-1] * 4
+        if k + 1 < len(rings):
+            tl2, tr2, br2, bl2 = corners[k + 1]
+            sh = (k % 2) * 0.5
+            for nn in range(joints):
+                t = (nn + sh) / joints
+                segs += [_lerp3(tl, tr, t) + _lerp3(tl2, tr2, t), _lerp3(bl, br, t) + _lerp3(bl2, br2, t),
+                         _lerp3(tl, bl, t) + _lerp3(tl2, bl2, t), _lerp3(tr, br, t) + _lerp3(tr2, br2, t)]
+                layers += [k] * 4
+                walls += [0, 1, 2, 3]
+        offsets.append(len(segs))
+    if _use_numpy(use_numpy):
+        segs = np.array(segs, dtype=np.float64).reshape(-1, 6)
+    return TunnelWorld(segs, layers, walls, rings, (half_w, half_h), offsets)
+
+
+def camera_basis(cam: Camera) -> Tuple[Tuple[float, float, float], ...]:
+    """Vetores (direita, cima, frente) da câmara."""
+    yaw, pitch = math.radians(cam.yaw), math.radians(cam.pitch)
+    f = (math.sin(yaw) * math.cos(pitch), math.sin(pitch), math.cos(yaw) * math.cos(pitch))
+    r = (math.cos(yaw), 0.0, -math.sin(yaw))
+    u = (f[1] * r[2] - f[2] * r[1], f[2] * r[0] - f[0] * r[2], f[0] * r[1] - f[1] * r[0])
+    return r, u, f
+
+
+def _project_py(segs, cam: Camera, w: int, h: int) -> Tuple[List[int], List[Segment]]:
+    r, u, f = camera_basis(cam)
+    focal = h / 2 / math.tan(math.radians(cam.fov) / 2)
+    cx, cy, near = w / 2, h / 2, cam.near
+    index: List[int] = []
+    out: List[Segment] = []
+    for i, (x1, y1, z1, x2, y2, z2) in enumerate(segs):
+        a = (x1 - cam.x, y1 - cam.y, z1 - cam.z)
+        b = (x2 - cam.x, y2 - cam.y, z2 - cam.z)
+        va = [a[0] * r[0] + a[1] * r[1] + a[2] * r[2], a[0] * u[0] + a[1] * u[1] + a[2] * u[2],
+              a[0] * f[0] + a[1] * f[1] + a[2] * f[2]]
+        vb = [b[0] * r[0] + b[1] * r[1] + b[2] * r[2], b[0] * u[0] + b[1] * u[1] + b[2] * u[2],
+              b[0] * f[0] + b[1] * f[1] + b[2] * f[2]]
+        if va[2] < near and vb[2] < near:
+            continue
+        # recorte no plano próximo: o extremo atrás é puxado para z = near
+        if va[2] < near or vb[2] < near:
+            t = (near - va[2]) / (vb[2] - va[2])
+            p = [va[j] + t * (vb[j] - va[j]) for j in range(3)]
+            if va[2] < near:
+                va = p
+            else:
+                vb = p
+        index.append(i)
+        out.append((cx + focal * va[0] / va[2], cy - focal * va[1] / va[2],
+                    cx + focal * vb[0] / vb[2], cy - focal * vb[1] / vb[2]))
+    return index, out
+
+
+def _project_np(segs, cam: Camera, w: int, h: int):
+    r, u, f = camera_basis(cam)
+    m = np.array([r, u, f], dtype=np.float64).T
+    c = np.array([cam.x, cam.y, cam.z])
+    va = (segs[:, :3] - c) @ m
+    vb = (segs[:, 3:] - c) @ m
+    za, zb = va[:, 2], vb[:, 2]
+    keep = (za >= cam.near) | (zb >= cam.near)
+    va, vb, za, zb = va[keep], vb[keep], za[keep], zb[keep]
+    # recorte no plano próximo (só nos segmentos que o atravessam)
+    cross = (za < cam.near) | (zb < cam.near)
+    if cross.any():
+        t = np.where(cross, (cam.near - za) / np.where(cross, zb - za, 1.0), 0.0)[:, None]
+        p = va + t * (vb - va)
+        va = np.where((za < cam.near)[:, None], p, va)
+        vb = np.where((zb < cam.near)[:, None], p, vb)
+    focal = h / 2 / math.tan(math.radians(cam.fov) / 2)
+    out = np.empty((len(va), 4))
+    out[:, 0] = w / 2 + focal * va[:, 0] / va[:, 2]
+    out[:, 1] = h / 2 - focal * va[:, 1] / va[:, 2]
+    out[:, 2] = w / 2 + focal * vb[:, 0] / vb[:, 2]
+    out[:, 3] = h / 2 - focal * vb[:, 1] / vb[:, 2]
+    return np.flatnonzero(keep), out
+
+
+def project_world(world: TunnelWorld, cam: Camera, w: int, h: int, start: int = 0,
+                  stop: Optional[int] = None) -> Tuple[List[int], List[Segment]]:
+    """
+    Projeta os segmentos dos anéis start..stop-1 do mundo para o ecrã (w x h),
+    recortando no plano próximo. Devolve os índices (em world) dos segmentos
+    que sobram e os segmentos 2D. Usa NumPy se o mundo tiver sido construído com NumPy.
+    """
+    stop = len(world.rings) if stop is None else min(stop, len(world.rings))
+    lo, hi = world.offsets[start], world.offsets[max(start, stop)]
+    if np is not None and isinstance(world.segs, np.ndarray):
+        index, out = _project_np(world.segs[lo:hi], cam, w, h)
+        return (index + lo).tolist(), list(map(tuple, out.tolist()))
+    index, out = _project_py(world.segs[lo:hi], cam, w, h)
+    return [i + lo for i in index], out
+
+
+def _to_camera(p: Vec3, cam: Camera, basis) -> Vec3:
+    d = (p[0] - cam.x, p[1] - cam.y, p[2] - cam.z)
+    return tuple(d[0] * v[0] + d[1] * v[1] + d[2] * v[2] for v in basis)
+
+
+def _ring_corners(ring, half: Tuple[float, float]) -> List[Vec3]:
+    (cx, cy, cz), r, u, _ = ring
+    W, H = half
+    return [(cx + sx * W * r[0] + sy * H * u[0], cy + sx * W * r[1] + sy * H * u[1],
+             cz + sx * W * r[2] + sy * H * u[2]) for sx, sy in ((-1, 1), (1, 1), (1, -1), (-1, -1))]
+
+
+def _clip_convex(poly: List[Point], clip: List[Point]) -> List[Point]:
+    """Interseção de dois polígonos convexos com a mesma orientação (Sutherland-Hodgman)."""
+    for i in range(len(clip)):
+        if not poly:
+            break
+        (ax, ay), (bx, by) = clip[i], clip[(i + 1) % len(clip)]
+        side = lambda p: (bx - ax) * (p[1] - ay) - (by - ay) * (p[0] - ax)
+        out: List[Point] = []
+        for j in range(len(poly)):
+            p, q = poly[j], poly[(j + 1) % len(poly)]
+            sp, sq = side(p), side(q)
+            if sp >= 0:
+                out.append(p)
+            if (sp >= 0) != (sq >= 0):
+                t = sp / (sp - sq)
+                out.append((p[0] + t * (q[0] - p[0]), p[1] + t * (q[1] - p[1])))
+        poly = out
+    return poly
+
+
+def _outside(poly: List[Point], segs: List[Segment]) -> List[bool]:
+    """True para os segmentos com os dois extremos do lado de fora da mesma aresta de `poly`."""
+    if not poly:
+        return [True] * len(segs)
+    edges = [(poly[i], poly[(i + 1) % len(poly)]) for i in range(len(poly))]
+    if np is not None and len(segs) > 16:
+        s = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+        out = np.zeros(len(s), dtype=bool)
+        for (ax, ay), (bx, by) in edges:
+            out |= (((bx - ax) * (s[:, 1] - ay) - (by - ay) * (s[:, 0] - ax) < 0)
+                    & ((bx - ax) * (s[:, 3] - ay) - (by - ay) * (s[:, 2] - ax) < 0))
+        return out.tolist()
+    return [any((bx - ax) * (y1 - ay) - (by - ay) * (x1 - ax) < 0
+                and (bx - ax) * (y2 - ay) - (by - ay) * (x2 - ax) < 0
+                for (ax, ay), (bx, by) in edges)
+            for x1, y1, x2, y2 in segs]
+
+
+def _camera_ring(world: TunnelWorld, cam: Camera) -> Optional[int]:
+    """
+    Primeiro anel à frente da câmara, se ela estiver dentro do túnel (ou à
+    entrada): dentro da secção desse anel e da do anterior. None se estiver fora.
+    """
+    p = (cam.x, cam.y, cam.z)
+    W, H = world.half
+    for k, (c, r, u, f) in enumerate(world.rings):
+        d = (p[0] - c[0], p[1] - c[1], p[2] - c[2])
+        if d[0] * f[0] + d[1] * f[1] + d[2] * f[2] < 0:
+            for c, r, u, _ in world.rings[max(k - 1, 0):k + 1]:
+                d = (p[0] - c[0], p[1] - c[1], p[2] - c[2])
+                if (abs(d[0] * r[0] + d[1] * r[1] + d[2] * r[2]) >= W
+                        or abs(d[0] * u[0] + d[1] * u[1] + d[2] * u[2]) >= H):
+                    return None
+            return k
+    return None
+
+
+def cull_projected(world: TunnelWorld, cam: Camera, w: int, h: int, index: List[int],
+                   segs: List[Segment], pad: float = 0.0, start: int = 0,
+                   stop: Optional[int] = None) -> Tuple[List[int], List[Segment], Dict[str, int]]:
+    """
+    Elimina, antes da submissão, os segmentos projetados que não podem ser vistos:
+      - "frustum": os dois extremos fora do mesmo lado do ecrã (alargado `pad` px);
+      - "occluded": fora da abertura dos anéis mais próximos. Com a câmara
+        dentro do túnel, a linha de vista até um ponto para lá do anel j
+        atravessa a secção do anel j (senão bate numa parede), logo a
+        projeção desse ponto cai dentro do quadrilátero projetado do anel j.
+        A abertura da camada k é a interseção do ecrã com esses
+        quadriláteros para os anéis j < k à frente da câmara.
+    `index`/`segs` vêm de project_world() para os anéis start..stop-1; os
+    segmentos recortados pelo plano próximo já lá não estão ("near").
+    O teste é conservador: nunca elimina nada visível.
+    """
+    stop = len(world.rings) if stop is None else min(stop, len(world.rings))
+    total = world.offsets[max(start, stop)] - world.offsets[start]
+    stats = {"segments": total, "near": total - len(index), "frustum": 0, "occluded": 0}
+    screen = [(-pad, -pad), (w + pad, -pad), (w + pad, h + pad), (-pad, h + pad)]
+    # abertura de cada camada (None = ecrã inteiro), orientada como o ecrã
+    apertures: Dict[int, Optional[List[Point]]] = {}
+    poly: Optional[List[Point]] = None
+    first = _camera_ring(world, cam)
+    basis = camera_basis(cam)
+    focal = h / 2 / math.tan(math.radians(cam.fov) / 2)
+    for k in range(start, stop):
+        apertures[k] = poly
+        if first is None or k < first:
+            continue
+        corners = [_to_camera(p, cam, basis) for p in _ring_corners(world.rings[k], world.half)]
+        if any(z < cam.near for _, _, z in corners):
+            continue
+        quad = [(w / 2 + focal * x / z, h / 2 - focal * y / z) for x, y, z in corners]
+        # orientar o quadrilátero como o ecrã (área com sinal positivo)
+        area = sum(quad[i - 1][0] * quad[i][1] - quad[i][0] * quad[i - 1][1] for i in range(4))
+        if area < 0:
+            quad.reverse()
+        poly = _clip_convex(screen if poly is None else poly, quad)
+
+    layers = world.layers
+    off_screen = _outside(screen, segs)
+    kept_index: List[int] = []
+    kept: List[Segment] = []
+    start = 0
+    while start < len(index):
+        # os segmentos vêm agrupados por camada (ordem de tunnel_world)
+        k = layers[index[start]]
+        stop = start
+        while stop < len(index) and layers[index[stop]] == k:
+            stop += 1
+        aperture = apertures[k]
+        hidden = (_outside(aperture, segs[start:stop]) if aperture is not None
+                  else [False] * (stop - start))
+        for n in range(start, stop):
+            if off_screen[n]:
+                stats["frustum"] += 1
+            elif hidden[n - start]:
+                stats["occluded"] += 1
+            else:
+                kept_index.append(index[n])
+                kept.append(segs[n])
+        start = stop
+    return kept_index, kept, stats
+
+
+class BrickGrid:
+    """
+    Índice de tijolos para a câmara 3D: os quadriláteros projetados de cada
+    tijolo numa grelha uniforme de células de `cell` px. Um ponto só é
+    testado contra os tijolos da sua célula; havendo vários, ganha o do
+    anel mais próximo (o que fica à frente).
+    """
+
+    def __init__(self, w: int, h: int, bricks: Iterable[Tuple[Tuple[int, int, int], List[Point]]],
+                 cell: int = 32):
+        self.cell = cell
+        self.cols = max(1, math.ceil(w / cell))
+        self.rows = max(1, math.ceil(h / cell))
+        self.quads: Dict[Tuple[int, int, int], List[Point]] = {}
+        self.cells: Dict[int, List[Tuple[int, int, int]]] = {}
+        for key, quad in bricks:
+            xs, ys = [p[0] for p in quad], [p[1] for p in quad]
+            c0, c1 = max(0, int(min(xs) // cell)), min(self.cols - 1, int(max(xs) // cell))
+            r0, r1 = max(0, int(min(ys) // cell)), min(self.rows - 1, int(max(ys) // cell))
+            if c0 > c1 or r0 > r1:
+                continue  # fora do ecrã
+            self.quads[key] = quad
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    self.cells.setdefault(r * self.cols + c, []).append(key)
+
+    def locate(self, x: float, y: float) -> Optional[Tuple[int, int, int]]:
+        if not (0 <= x < self.cols * self.cell and 0 <= y < self.rows * self.cell):
+            return None
+        hits = [key for key in self.cells.get(int(y // self.cell) * self.cols + int(x // self.cell), ())
+                if _in_quad(self.quads[key], x, y)]
+        return min(hits) if hits else None
+
+    def polygon(self, brick: Tuple[int, int, int]) -> Optional[List[float]]:
+        quad = self.quads.get(brick)
+        return None if quad is None else [v for p in quad for v in p]
+
+
+def _in_quad(quad: List[Point], x: float, y: float) -> bool:
+    # ponto dentro de um quadrilátero convexo, qualquer que seja a orientação
+    signs = [(bx - ax) * (y - ay) - (by - ay) * (x - ax)
+             for (ax, ay), (bx, by) in zip(quad, quad[1:] + quad[:1])]
+    return all(s >= 0 for s in signs) or all(s <= 0 for s in signs)
+
+
+def world_bricks(world: TunnelWorld, cam: Camera, w: int, h: int, start: int = 0,
+                 stop: Optional[int] = None, joints: int = 16) -> Iterator[Tuple[Tuple[int, int, int], List[Point]]]:
+    """
+    Quadriláteros projetados dos tijolos dos anéis start..stop-1 (com a mesma
+    divisão das juntas de tunnel_world()); saltam-se os que cruzam o plano próximo.
+    """
+    stop = len(world.rings) - 1 if stop is None else min(stop, len(world.rings) - 1)
+    basis = camera_basis(cam)
+    focal = h / 2 / math.tan(math.radians(cam.fov) / 2)
+    corners = None
+    for k in range(start, stop):
+        if corners is None:
+            corners = _ring_corners(world.rings[k], world.half)
+        nxt = _ring_corners(world.rings[k + 1], world.half)
+        tl, tr, br, bl = corners
+        tl2, tr2, br2, bl2 = nxt
+        sh = (k % 2) * 0.5
+        cuts = [0.0] + [(nn + sh) / joints for nn in range(joints)] + [1.0]
+        # (início, fim) de cada parede no anel k e no anel k+1, como em tunnel_world()
+        for wall, (a0, a1, b0, b1) in enumerate(((tl, tr, tl2, tr2), (bl, br, bl2, br2),
+                                                 (tl, bl, tl2, bl2), (tr, br, tr2, br2))):
+            for i in range(len(cuts) - 1):
+                p = [_lerp3(a0, a1, cuts[i]), _lerp3(a0, a1, cuts[i + 1]),
+                     _lerp3(b0, b1, cuts[i + 1]), _lerp3(b0, b1, cuts[i])]
+                v = [_to_camera(q, cam, basis) for q in p]
+                if any(z < cam.near for _, _, z in v):
+                    continue
+                yield (k, wall, i), [(w / 2 + focal * vx / vz, h / 2 - focal * vy / vz) for vx, vy, vz in v]
+        corners = nxt
+
+
+# ---------------------------------------------------------------------------
+# Exportação em ladrilhos, rasterizados em paralelo (ProcessPoolExecutor)
+# diretamente para um buffer em memória partilhada.
+# ---------------------------------------------------------------------------
+
+def tile_segments(segs, x0: float, y0: float, x1: float, y1: float, pad: float) -> Joints:
+    """
+    Segmentos que tocam o ladrilho [x0, x1) x [y0, y1), com folga `pad` para o
+    pincel. Os horizontais e verticais (as arestas dos anéis, que podem ter
+    milhares de pixels) são cortados ao ladrilho; os restantes são curtos e
+    vão inteiros, porque cortá-los mudaria os pixels do DDA nas costuras.
+    """
+    lo_x, hi_x, lo_y, hi_y = x0 - pad, x1 + pad, y0 - pad, y1 + pad
+    if np is not None and isinstance(segs, np.ndarray):
+        sx0, sy0, sx1, sy1 = segs.T
+        s = segs[(np.maximum(sx0, sx1) >= lo_x) & (np.minimum(sx0, sx1) <= hi_x)
+                 & (np.maximum(sy0, sy1) >= lo_y) & (np.minimum(sy0, sy1) <= hi_y)]
+        sx0, sy0, sx1, sy1 = s.T
+        hor = sy0 == sy1
+        ver = (sx0 == sx1) & ~hor
+        lo, hi = np.minimum(sx0, sx1), np.maximum(sx0, sx1)
+        s[hor, 0], s[hor, 2] = np.maximum(lo[hor], lo_x), np.minimum(hi[hor], hi_x)
+        lo, hi = np.minimum(sy0, sy1), np.maximum(sy0, sy1)
+        s[ver, 1], s[ver, 3] = np.maximum(lo[ver], lo_y), np.minimum(hi[ver], hi_y)
+        return s
+    out: List[Segment] = []
+    for sx0, sy0, sx1, sy1 in segs:
+        if (max(sx0, sx1) < lo_x or min(sx0, sx1) > hi_x
+                or max(sy0, sy1) < lo_y or min(sy0, sy1) > hi_y):
+            continue
+        if sy0 == sy1:
+            sx0, sx1 = max(min(sx0, sx1), lo_x), min(max(sx0, sx1), hi_x)
+        elif sx0 == sx1:
+            sy0, sy1 = max(min(sy0, sy1), lo_y), min(max(sy0, sy1), hi_y)
+        out.append((sx0, sy0, sx1, sy1))
+    return out
+
+
+def clip_segments(segs, x0: float, y0: float, x1: float, y1: float) -> List[Segment]:
+    """
+    Recorta os segmentos ao retângulo [x0, x1] x [y0, y1] (Liang–Barsky); os que
+    ficam inteiramente fora desaparecem e os que estão dentro não mudam.
+    """
+    out: List[Segment] = []
+    for seg in segs:
+        sx0, sy0, sx1, sy1 = seg
+        dx, dy = sx1 - sx0, sy1 - sy0
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dx, sx0 - x0), (dx, x1 - sx0), (-dy, sy0 - y0), (dy, y1 - sy0)):
+            if p == 0:
+                if q < 0:  # paralelo a esta aresta e do lado de fora
+                    break
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+            if t0 > t1:
+                break
+        else:
+            if t0 == 0.0 and t1 == 1.0:
+                out.append(seg)
+            else:
+                out.append((sx0 + t0 * dx, sy0 + t0 * dy, sx0 + t1 * dx, sy0 + t1 * dy))
+    return out
+
+
+def tile_polygons(polys, colors, boxes: List[Rect], x0: float, y0: float, x1: float, y1: float):
+    """
+    (polígonos, cores) cuja caixa `boxes[i]` toca o ladrilho [x0, x1) x [y0, y1),
+    pela ordem original; o recorte ao pixel fica para fill_polygons().
+    """
+    keep = [i for i, (bx0, by0, bx1, by1) in enumerate(boxes)
+            if bx0 <= x1 and bx1 >= x0 and by0 <= y1 and by1 >= y0]
+    if np is not None and isinstance(colors, np.ndarray):
+        return [polys[i] for i in keep], colors[keep]
+    return [polys[i] for i in keep], [colors[i] for i in keep]
+
+
+def _render_tile(shm_name: str, w: int, tile: Tuple[int, int, int, int], ring_segs: List[Segment],
+                 joints: Joints, line_width: int, bg, use_numpy: Optional[bool], bricks=None) -> float:
+    # Corre num processo do pool: escreve o ladrilho diretamente na memória partilhada
+    t0 = time.perf_counter()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        tx, ty, tw, th = tile
+        raster = Raster(tw, th, bg, use_numpy, buf=shm.buf, x0=tx, y0=ty, stride=w)
+        raster.clear()
+        if bricks is not None:
+            raster.fill_polygons(*bricks)
+        raster.lines(ring_segs, line_width)
+        raster.lines(joints, max(1, line_width-1))
+        del raster
+    finally:
+        shm.close()
+    return time.perf_counter() - t0
+
+
+def export_tiled(path: str, w: int, h: int, rings: List[Rect], joints: Joints,
+                 line_width: int = 2, bg="#FFD300", tile: int = 1024, workers: Optional[int] = None,
+                 use_numpy: Optional[bool] = None, bricks=None) -> dict:
+    """
+    Rasteriza uma imagem grande em ladrilhos de tile x tile num ProcessPoolExecutor
+    e grava-a em PNG ou PPM. Os processos escrevem num SharedMemory comum:
+    só as listas de segmentos (já recortadas por ladrilho) são enviadas, os
+    pixels nunca passam por pickle. `bricks` = (polígonos, cores) são
+    preenchidos por baixo das linhas, como em draw_raster().
+    """
+    ring_segs = rect_segments(rings)
+    boxes = [(min(p[::2]), min(p[1::2]), max(p[::2]), max(p[1::2])) for p in bricks[0]] if bricks is not None else []
+    tiles = [(tx, ty, min(tile, w - tx), min(tile, h - ty))
+             for ty in range(0, h, tile) for tx in range(0, w, tile)]
+    t0 = time.perf_counter()
+    shm = shared_memory.SharedMemory(create=True, size=w * h * 3)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(_render_tile, shm.name, w, (tx, ty, tw, th),
+                                tile_segments(ring_segs, tx, ty, tx + tw, ty + th, line_width),
+                                tile_segments(joints, tx, ty, tx + tw, ty + th, line_width),
+                                line_width, bg, use_numpy,
+                                tile_polygons(*bricks, boxes, tx, ty, tx + tw, ty + th) if bricks is not None else None)
+                     for tx, ty, tw, th in tiles]
+            busy = sum(job.result() for job in jobs)
+        t1 = time.perf_counter()
+        image = Raster(w, h, bg, use_numpy, buf=shm.buf)
+        data = image.to_png() if path.lower().endswith(".png") else image.to_ppm()
+        del image
+        with open(path, "wb") as f:
+            f.write(data)
+    finally:
+        shm.close()
+        shm.unlink()
+    return {"tiles": len(tiles), "workers": workers or os.cpu_count(), "raster_s": t1 - t0,
+            "tile_busy_s": busy, "write_s": time.perf_counter() - t1}
+
+
+class _ItemPool:
+    """Itens do canvas reaproveitados no modo retained, quantos estão visíveis e com que espessura."""
+
+    def __init__(self):
+        self.items: List[int] = []
+        self.shown = 0
+        self.width: Optional[int] = None
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.shown = 0
+        self.width = None
+
 
 class GameEngine:
     """
@@ -13,14 +1679,89 @@ class GameEngine:
     'tijolos' começam grandes e ficam pequenos até ao infinito.
     """
 
-    def __init__(self, root: tk.Tk, bg="#FFD300"):  # amarelo forte
+    def __init__(self, root: "tk.Tk", bg="#FFD300",  # amarelo forte
+                 retained: bool = False, max_fps: float = 60.0, use_numpy: Optional[bool] = None,
+                 geometry_cache_size: int = 32, backend: str = "canvas",
+                 hud: bool = False, batch_joints: bool = False,
+                 streaming: bool = False, loop_cache: Optional[LoopCache] = None,
+                 camera: Optional[Camera] = None):
+        _require_tk()
         self.root = root
         self.bg = bg
+        # "canvas": um item Tk por anel/junta; "raster": tudo rasterizado num
+        # buffer RGB e enviado ao canvas como uma única PhotoImage
+        if backend not in ("canvas", "raster"):
+            raise ValueError("backend desconhecido: %r" % (backend,))
+        self.backend = backend
+        self._raster: Optional[Raster] = None
+        self._photo = None
+        self._image_item = None
+        # HUD de desempenho e hooks de tempos por fase (ver add_timing_hook)
+        self.hud = hud
+        self._timing_hooks: List[Callable[[str, float], None]] = []
+        self.phase_times: Dict[str, float] = {}
+        self.item_count = 0
+        self._redraw_stamps: deque = deque()
+        # Núcleo de geometria vetorizado (NumPy); None = usar se estiver instalado
+        self.use_numpy = use_numpy
+        # Geometria já calculada, para estados repetidos (resize, +/-) saírem de graça
+        self.geometry_cache = GeometryCache(geometry_cache_size)
+        # Modo "retained": os itens do canvas são criados uma vez e depois
+        # apenas reposicionados com coords() em vez de delete("all") + create_*
+        self.retained = retained
+        self._ring_pool = _ItemPool()
+        self._joint_pool = _ItemPool()
+        # a vista 3D tem itens próprios (etiqueta "camera"), apagados ao voltar ao 2D
+        self._camera_drawn = False
+        # Juntas agrupadas numa única polilinha por parede (4 itens em vez de milhares)
+        self.batch_joints = batch_joints
+        # Geometria consumida como fluxo de comandos (iter_draw_commands), sem
+        # listas nem cache; não se aplica aos modos retained/batch_joints
+        self.streaming = streaming
+        # Durante a animação, percorrer um período pré-calculado (LoopCache)
+        # em vez de recalcular a geometria em cada frame
+        self.loop_cache = loop_cache
+        # Câmara 3D (None = a vista 2D clássica com o ponto de fuga ao centro).
+        # O túnel no mundo tem anéis de 2*half_w x 2*half_h a cada `spacing`.
+        self.camera = camera
+        self.spacing = 1.0
+        self.tunnel_half = (1.5, 1.0)
+        # Eixo curvo (TunnelPath); com câmara, camera.z passa a ser a distância ao longo dele
+        self.path: Optional[TunnelPath] = None
+        # Índice de tijolos para cliques (BrickIndex na vista 2D, BrickGrid com
+        # câmara), reconstruído só quando a geometria muda; tijolo selecionado
+        # e anotações {(anel, parede, tijolo): texto}
+        self._brick_index = None
+        self._brick_index_key = None
+        self.selected_brick: Optional[Tuple[int, int, int]] = None
+        self.annotations: Dict[Tuple[int, int, int], str] = {}
+        # Recorte antes da submissão (ver cull_projected): contagens do último
+        # frame em cull_stats e acumuladas em culled_total
+        self.culling = True
+        self.cull_stats: Dict[str, int] = {}
+        self.culled_total: Dict[str, int] = {"near": 0, "frustum": 0, "occluded": 0}
+        # Tijolos preenchidos (brick_quads/brick_colors), com luz e nevoeiro
+        # que escurecem com a profundidade; só na vista 2D
+        self.filled = False
+        self.shading = BrickShading()
+        # Atualização incremental quando só depth_layers muda (ver _update_layers)
+        self._drawn_state = None
+        self._drawn_layers = 0
+        self._drawn_depth = 0
+        # Agendador de redesenho: os pedidos só marcam a cena como "suja" e
+        # no máximo um redesenho por frame (max_fps) é efetivamente feito.
+        # max_fps <= 0 desliga o limite (apenas after_idle).
+        self.max_fps = max_fps
+        self.redraw_requests = 0
+        self.redraws_performed = 0
+        self._dirty = False
+        self._redraw_job = None
+        self._last_redraw = 0.0
         self.canvas = tk.Canvas(root, highlightthickness=0, bg=bg)
         self.canvas.pack(fill="both", expand=True)
 
         # Render sempre que a janela muda de tamanho
-        self.canvas.bind("<Configure>", lambda e: self.redraws())
+        self.canvas.bind("<Configure>", lambda e: self.request_redraw())
 
         # Controlos simples (teclas) para afinar rapidamente se quiser:
         # [+]/[-] = mais/menos profundidade; [.] = fator mais pequeno; [,] = fator maior
@@ -28,6 +1769,22 @@ class GameEngine:
         root.bind("-", lambda e: self._bump_depth( -5))
         root.bind(".", lambda e: self._bump_scale( 0.02))
         root.bind(",", lambda e: self._bump_scale(-0.02))
+        # [espaço] = ligar/desligar a animação; [l] = ligar/desligar o nível de detalhe
+        root.bind("l", lambda e: self.toggle_lod())
+        # [h] = mostrar/esconder o HUD de desempenho
+        root.bind("h", lambda e: self.toggle_hud())
+        # [c] = câmara 3D; setas = yaw/pitch; [w]/[s] = avançar/recuar
+        root.bind("c", lambda e: self.toggle_camera())
+        root.bind("<Left>", lambda e: self._turn_camera(-3, 0))
+        root.bind("<Right>", lambda e: self._turn_camera(3, 0))
+        root.bind("<Up>", lambda e: self._turn_camera(0, 3))
+        root.bind("<Down>", lambda e: self._turn_camera(0, -3))
+        root.bind("w", lambda e: self._move_camera(0.2))
+        root.bind("s", lambda e: self._move_camera(-0.2))
+        # [f] = tijolos preenchidos / só linhas
+        root.bind("f", lambda e: self.toggle_filled())
+        # clique = selecionar o tijolo sob o rato
+        self.canvas.bind("<Button-1>", lambda e: self.select_brick(e.x, e.y))
 
         # parâmetros visuais
         self.margin = 16
@@ -35,79 +1792,669 @@ class GameEngine:
         self.scale = 0.92           # fator de encolhimento por camada (0.80–0.96)
         self.line_width = 2
         self.running_bond_offset = 0.0  # fase inicial do padrão dos tijolos
+        self.lod: Optional[LevelOfDetail] = None  # nível de detalhe (None = 16 juntas sempre)
+
+        # Animação (voo pelo túnel): a fase avança a passo fixo (anim_dt) num
+        # ciclo conduzido por after(); o render usa a fase interpolada.
+        self.anim_speed = 1.0           # anéis por segundo
+        self.anim_fps = 60.0            # frames por segundo pretendidos
+        self.anim_dt = 1.0 / 120.0      # passo fixo da simulação (s)
+        self.anim_max_lag = 0.25        # atraso máximo recuperado; o resto é descartado
+        self.anim_frames = 0
+        self.anim_frames_dropped = 0
+        self._anim_job = None
+        self._anim_phase = self._anim_prev = 0.0
+        self._anim_acc = 0.0
+        self._anim_last = 0.0
+        root.bind("<space>", lambda e: self.toggle_animation())
         self.redraws()
 
     # Pequenos helpers para ajustar em tempo real
     def _bump_depth(self, delta: int):
         self.depth_layers = max(10, min(200, self.depth_layers + delta))
-        self.redraws()
+        self.request_redraw()
 
     def _bump_scale(self, delta: float):
         self.scale = max(0.80, min(0.97, self.scale + delta))
+        self.request_redraw()
+
+    def toggle_lod(self):
+        self.lod = None if self.lod else LevelOfDetail()
+        self.request_redraw()
+
+    def toggle_filled(self):
+        self.filled = not self.filled
+        if not self.filled:
+            self.canvas.delete("fill")
+        self.request_redraw()
+
+    def toggle_camera(self):
+        self.camera = None if self.camera else Camera()
+        self.request_redraw()
+
+    def _turn_camera(self, dyaw: float, dpitch: float):
+        if self.camera:
+            cam = self.camera
+            self.camera = cam._replace(yaw=cam.yaw + dyaw, pitch=max(-89.0, min(89.0, cam.pitch + dpitch)))
+            self.request_redraw()
+
+    def _move_camera(self, dist: float):
+        if self.camera and self.path is not None:
+            self.camera = self.camera._replace(z=self.camera.z + dist)
+            self.request_redraw()
+        elif self.camera:
+            _, _, f = camera_basis(self.camera)
+            cam = self.camera
+            self.camera = cam._replace(x=cam.x + f[0] * dist, y=cam.y + f[1] * dist, z=cam.z + f[2] * dist)
+            self.request_redraw()
+
+    # Animação com passo fixo
+    @property
+    def animating(self) -> bool:
+        return self._anim_job is not None
+
+    def start_animation(self, speed: Optional[float] = None, fps: Optional[float] = None):
+        """Começa o voo pelo túnel (speed em anéis/s, fps pretendidos)."""
+        if speed is not None:
+            self.anim_speed = speed
+        if fps is not None:
+            self.anim_fps = fps
+        if self.animating:
+            return
+        self._anim_phase = self._anim_prev = self.running_bond_offset
+        self._anim_acc = 0.0
+        self._anim_last = time.perf_counter()
+        self._anim_job = self.root.after(0, self._anim_tick)
+
+    def stop_animation(self):
+        if self._anim_job is not None:
+            self.root.after_cancel(self._anim_job)
+            self._anim_job = None
+
+    def toggle_animation(self):
+        if self.animating:
+            self.stop_animation()
+        else:
+            self.start_animation()
+
+    def _anim_tick(self):
+        now = time.perf_counter()
+        elapsed = now - self._anim_last
+        self._anim_last = now
+        budget = 1.0 / self.anim_fps
+        if elapsed > 1.5 * budget:
+            self.anim_frames_dropped += int(elapsed / budget) - 1
+        # Sob carga não se tenta recuperar todo o atraso: descartam-se frames
+        # em vez de acumular passos (e eventos) na fila do Tk.
+        self._anim_acc += min(elapsed, self.anim_max_lag)
+        # a cena repete-se a cada 2 anéis; ao longo de um caminho curvo, só no fim dele
+        period = 2.0
+        if self.camera is not None and self.path is not None:
+            period = max(period, self.path.length / self.spacing)
+        while self._anim_acc >= self.anim_dt:
+            self._anim_prev = self._anim_phase
+            self._anim_phase = (self._anim_phase + self.anim_speed * self.anim_dt) % period
+            self._anim_acc -= self.anim_dt
+        # Interpolar entre os dois últimos estados para o movimento ser contínuo
+        alpha = self._anim_acc / self.anim_dt
+        delta = (self._anim_phase - self._anim_prev) % period
+        self.running_bond_offset = (self._anim_prev + delta * alpha) % period
+        self.anim_frames += 1
+        self.request_redraw()
+
+        spent = time.perf_counter() - now
+        self._anim_job = self.root.after(max(1, int((budget - spent) * 1000)), self._anim_tick)
+
+    # Agendador de redesenho (coalesce eventos <Configure> e auto-repeat das teclas)
+    @property
+    def redraws_dropped(self) -> int:
+        """Pedidos de redesenho que foram absorvidos por outro redesenho."""
+        return self.redraw_requests - self.redraws_performed
+
+    def request_redraw(self):
+        """Marca a cena como suja e agenda um redesenho (no máximo um por frame)."""
+        self.redraw_requests += 1
+        self._dirty = True
+        if self._redraw_job is not None:
+            return
+        wait = 0.0
+        if self.max_fps > 0:
+            wait = self._last_redraw + 1.0 / self.max_fps - time.perf_counter()
+        if wait > 0:
+            self._redraw_job = self.root.after(int(wait * 1000) + 1, self._flush_redraw)
+        else:
+            self._redraw_job = self.root.after_idle(self._flush_redraw)
+
+    def _flush_redraw(self):
+        self._redraw_job = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._last_redraw = time.perf_counter()
+        self.redraws_performed += 1
         self.redraws()
+        if self.selected_brick is not None or self.annotations:
+            self._draw_bricks()
 
     def _frames(self, w: int, h: int) -> List[Rect]:
         """Gera retângulos concêntricos que convergem ao centro (ponto de fuga)."""
-        cx, cy = w / 2, h / 2
-        x1, y1, x2, y2 = self.margin, self.margin, w - self.margin, h - self.margin
-
-        frames: List[Rect] = []
-        for _ in range(self.depth_layers):
-            frames.append((x1, y1, x2, y2))
-            # Aproximar ao centro por fator de escala
-            x1 = cx + (x1 - cx) * self.scale
-            y1 = cy + (y1 - cy) * self.scale
-            x2 = cx + (x2 - cx) * self.scale
-            y2 = cy + (y2 - cy) * self.scale
-            if abs(x2 - x1) < 2 or abs(y2 - y1) < 2:
-                break
-        return frames
+        return tunnel_frames(w, h, self.margin, self.depth_layers, self.scale,
+                             self.running_bond_offset, self.lod)
+
+    def _canvas_size(self) -> Tuple[int, int]:
+        return self.canvas.winfo_width() or 800, self.canvas.winfo_height() or 600
+
+    def ring(self, k: int) -> Rect:
+        """Retângulo do anel k para o tamanho e parâmetros atuais, em O(1)."""
+        w, h = self._canvas_size()
+        return ring_rect(w, h, self.margin, self.scale, k, self.running_bond_offset)
+
+    def rings_between(self, start: int, stop: int) -> List[Rect]:
+        """Anéis start..stop-1 sem gerar a lista completa."""
+        w, h = self._canvas_size()
+        return ring_range(w, h, self.margin, self.scale, start, stop, self.running_bond_offset)
+
+    def depth_below(self, px: float) -> int:
+        """Índice do primeiro anel com menos de `px` pixels."""
+        w, h = self._canvas_size()
+        return depth_for_size(w, h, self.margin, self.scale, px, self.running_bond_offset)
+
+    def _joints(self, frames: List[Rect]) -> Joints:
+        """Juntas dos tijolos (running bond) entre cada par de anéis consecutivos."""
+        return brick_joints(frames, self.use_numpy, phase_parity(self.running_bond_offset), self.lod)
+
+    def _geometry(self, w: int, h: int) -> Tuple[List[Rect], Joints]:
+        """Anéis e juntas para uma janela w x h, através da cache LRU (exceto durante a animação)."""
+        key = (w, h, self.depth_layers, self.scale, self.margin, self.running_bond_offset, self.lod)
+
+        def compute():
+            if not self._profiling:
+                frames = self._frames(w, h)
+                return frames, self._joints(frames)
+            t = time.perf_counter()
+            frames = self._frames(w, h)
+            t = self._emit("frames", t)
+            joints = self._joints(frames)
+            self._emit("joint_geometry", t)
+            return frames, joints
+
+        if self.animating:
+            # cada frame da animação tem uma fase nova: seria sempre uma falha e
+            # expulsaria da LRU os estados (resize, +/-) que ela existe para guardar
+            return compute()
+        return self.geometry_cache.get(key, compute)
+
+    def _bricks(self, w: int, h: int, frames: List[Rect], joints: Joints):
+        """(polígonos, cores) dos tijolos preenchidos, através da cache LRU."""
+        key = ("bricks", w, h, self.depth_layers, self.scale, self.margin, self.running_bond_offset,
+               self.lod, self.shading, self.use_numpy)
+
+        def compute():
+            polys, layers, walls, bricks = brick_quads(frames, joints, self.lod)
+            return polys, brick_colors(layers, walls, bricks, self.shading, self.use_numpy)
+
+        if self.animating:  # como em _geometry: uma fase nova por frame
+            return compute()
+        return self.geometry_cache.get(key, compute)
+
+    # Instrumentação: só custa alguma coisa com o HUD ligado ou com hooks registados
+    @property
+    def _profiling(self) -> bool:
+        return self.hud or bool(self._timing_hooks)
 
-      
-    def redraws(self):
-        """Refaz todo o desenho (linhas pretas sobre janela amarela)."""
+    def add_timing_hook(self, hook: Callable[[str, float], None]) -> None:
+        """
+        Regista hook(fase, segundos), chamado em cada redesenho para as fases
+        "frames", "joint_geometry" (só quando a geometria não vem da cache),
+        "rings", "joints", "fill" (tijolos preenchidos), "blit" (backend raster)
+        e "frame" (total). Em modo
+        streaming a geometria e a submissão são intercaladas: só há "frame".
+        """
+        self._timing_hooks.append(hook)
+
+    def remove_timing_hook(self, hook: Callable[[str, float], None]) -> None:
+        self._timing_hooks.remove(hook)
+
+    def _emit(self, phase: str, start: float) -> float:
+        now = time.perf_counter()
+        self.phase_times[phase] = now - start
+        for hook in self._timing_hooks:
+            hook(phase, now - start)
+        return now
+
+    def toggle_hud(self):
+        self.hud = not self.hud
+        if not self.hud:
+            self.canvas.delete("hud")
+        self.request_redraw()
+
+    def _draw_hud(self, frame_time: float) -> None:
+        now = time.perf_counter()
+        self._redraw_stamps.append(now)
+        while now - self._redraw_stamps[0] > 1.0:
+            self._redraw_stamps.popleft()
+        pt = self.phase_times
+        geometry = pt.get("frames", 0.0) + pt.get("joint_geometry", 0.0)
+        submit = sum(pt.get(k, 0.0) for k in ("fill", "rings", "joints", "blit"))
+        text = ("frame %.1f ms | geometria %.1f ms | submissão %.1f ms\n"
+                "itens %d | %d redesenhos/s" % (frame_time * 1000, geometry * 1000, submit * 1000,
+                                              self.item_count, len(self._redraw_stamps)))
+        if self.camera is not None and self.culling and self.cull_stats:
+            cs = self.cull_stats
+            text += "\nrecortados: plano próximo %d | fora do ecrã %d | ocultos %d (de %d)" % (
+                cs["near"], cs["frustum"], cs["occluded"], cs["segments"])
         c = self.canvas
-        c.delete("all")
-        w = c.winfo_width() or 800
-        h = c.winfo_height() or 600
+        c.delete("hud")
+        label = c.create_text(10, 8, anchor="nw", text=text, font="TkFixedFont", fill="black", tags="hud")
+        c.create_rectangle(c.bbox(label), fill=self.bg, outline="black", tags="hud")
+        c.tag_raise(label)
 
-        # fundo amarelo
-        c.configure(bg=self.bg)
+    def _sync_pool(self, pool: _ItemPool, coords: List[Rect], create, width: int) -> None:
+        """
+        Reaproveita os itens do pool: coords() nos existentes, cria os que faltam
+        e esconde o excedente. Só há itemconfigure() para os itens que mudam de
+        estado, ou para todos quando a espessura (line_width) muda.
+        """
+        c = self.canvas
+        items = pool.items
+        restyle = width != pool.width
+        for i, xy in enumerate(coords):
+            if i < len(items):
+                c.coords(items[i], *xy)
+                if restyle or i >= pool.shown:
+                    c.itemconfigure(items[i], state="normal", width=width)
+            else:
+                items.append(create(*xy))
+        for item in items[len(coords):pool.shown]:
+            c.itemconfigure(item, state="hidden")
+        pool.shown, pool.width = len(coords), width
+
+    def export_vector(self, path: str) -> None:
+        """Grava o túnel tal como está no canvas em SVG ou EPS (consoante a extensão de `path`)."""
+        w, h = self._canvas_size()
+        writer = write_eps if os.path.splitext(path)[1].lower() in (".eps", ".ps") else write_svg
+        writer(path, w, h, lambda: iter_draw_commands(
+            w, h, self.margin, self.depth_layers, self.scale, self.running_bond_offset,
+            self.lod, self.line_width), self.bg)
+
+    def _world(self) -> TunnelWorld:
+        """Geometria 3D do túnel (independente da câmara), através da cache LRU."""
+        # com caminho, o mundo cobre-o todo e cada frame projeta só depth_layers anéis
+        depth = self.depth_layers if self.path is None else int(self.path.length / self.spacing) + 1
+        key = ("world", depth, self.spacing, self.tunnel_half, _use_numpy(self.use_numpy), self.path)
+        return self.geometry_cache.get(key, lambda: tunnel_world(
+            depth, self.spacing, *self.tunnel_half, use_numpy=self.use_numpy, path=self.path))
+
+    def _camera_view(self):
+        """Câmara efetiva e intervalo de anéis a projetar no frame atual."""
+        s = self.camera.z + self.running_bond_offset * self.spacing
+        if self.path is None:
+            return self.camera._replace(z=s), 0, None
+        start = max(0, int(s / self.spacing))
+        return self.path.camera(self.camera, s), start, start + self.depth_layers
+
+    def brick_index(self):
+        """O índice de tijolos da vista atual, reconstruído só se a geometria tiver mudado."""
+        w, h = self._canvas_size()
+        if self.camera is None:
+            key = (w, h, self.depth_layers, self.scale, self.margin, self.running_bond_offset, self.lod)
+        else:
+            key = (w, h, self._camera_view(), self.depth_layers, self.spacing, self.tunnel_half, self.path)
+        if key != self._brick_index_key:
+            if self.camera is None:
+                frames, joints = self._geometry(w, h)
+                self._brick_index = BrickIndex(frames, joints, self.lod)
+            else:
+                cam, start, stop = key[2]
+                self._brick_index = BrickGrid(w, h, world_bricks(self._world(), cam, w, h, start, stop))
+            self._brick_index_key = key
+        return self._brick_index
+
+    def brick_at(self, x: float, y: float) -> Optional[Tuple[int, int, int]]:
+        """(anel, parede, tijolo) sob o ponto (x, y) do canvas, ou None."""
+        return self.brick_index().locate(x, y)
+
+    def select_brick(self, x: float, y: float) -> Optional[Tuple[int, int, int]]:
+        """Seleciona (e realça) o tijolo sob o ponto; clicar fora das paredes limpa a seleção."""
+        self.selected_brick = self.brick_at(x, y)
+        self._draw_bricks()
+        return self.selected_brick
+
+    def annotate(self, brick: Tuple[int, int, int], text: Optional[str]) -> None:
+        """Escreve `text` sobre o tijolo (None apaga a anotação)."""
+        if text is None:
+            self.annotations.pop(brick, None)
+        else:
+            self.annotations[brick] = text
+        self._draw_bricks()
+
+    def _draw_bricks(self) -> None:
+        # Realce e anotações por cima do desenho (funciona também com o backend raster)
+        c = self.canvas
+        c.delete("brick")
+        if self.selected_brick is None and not self.annotations:
+            return
+        index = self.brick_index()
+        if self.selected_brick is not None:
+            poly = index.polygon(self.selected_brick)
+            if poly:
+                c.create_polygon(*poly, fill="", outline="red", width=2, tags="brick")
+        for brick, text in self.annotations.items():
+            poly = index.polygon(brick)
+            if poly:
+                c.create_text(sum(poly[::2]) / 4, sum(poly[1::2]) / 4, text=text, fill="red",
+                              font="TkSmallCaptionFont", tags="brick")
+
+    def _redraw_camera(self, w: int, h: int, prof: bool) -> None:
+        # Vista 3D: só a projeção é refeita por frame; a animação avança a câmara
+        self._drawn_state = None
+        world = self._world()
+        t = time.perf_counter() if prof else 0.0
+        # com caminho: consulta à tabela + projeção dos depth_layers anéis seguintes
+        cam, start, stop = self._camera_view()
+        index, segs = project_world(world, cam, w, h, start, stop)
+        if self.culling:
+            index, segs, self.cull_stats = cull_projected(world, cam, w, h, index, segs,
+                                                          self.line_width, start, stop)
+            for k in self.culled_total:
+                self.culled_total[k] += self.cull_stats[k]
+        if prof:
+            t = self._emit("frames", t)
+        walls = world.walls
+        # perto do plano próximo a projeção dá segmentos com milhões de pixels:
+        # cortados ao ecrã (com folga para o pincel), o custo do DDA fica limitado
+        # pelo tamanho da janela e não depende do recorte (culling) estar ligado
+        box = (-self.line_width, -self.line_width, w + self.line_width, h + self.line_width)
+        rings = clip_segments([s for i, s in zip(index, segs) if walls[i] < 0], *box)
+        joints = clip_segments([s for i, s in zip(index, segs) if walls[i] >= 0], *box)
+        jw = max(1, self.line_width-1)
+        if self.backend == "raster":
+            if self._raster is None or (self._raster.w, self._raster.h) != (w, h):
+                self._raster = Raster(w, h, self.bg, self.use_numpy)
+            else:
+                self._raster.clear()
+            self._raster.lines(rings, self.line_width)
+            self._raster.lines(joints, jw)
+            self._show_photo(tk.PhotoImage(width=w, height=h, data=self._raster.to_ppm(), format="PPM"))
+            self.item_count = 1
+        else:
+            c = self.canvas
+            if self._camera_drawn:
+                c.delete("camera")
+            else:  # primeiro frame 3D: sai tudo o que o 2D deixou (incluindo os pools)
+                self._clear_canvas()
+                self._camera_drawn = True
+            for seg in rings:
+                c.create_line(*seg, width=self.line_width, fill="black", tags="camera")
+            for seg in joints:
+                c.create_line(*seg, width=jw, fill="black", tags="camera")
+            self.item_count = len(rings) + len(joints)
+        if prof:
+            self._emit("blit" if self.backend == "raster" else "joints", t)
+
+    def _clear_canvas(self) -> None:
+        """Apaga todos os itens; os pools e a imagem do backend raster deixam de existir também."""
+        self.canvas.delete("all")
+        self._ring_pool.clear()
+        self._joint_pool.clear()
+        self._image_item = None
+
+    def _redraw_stream(self, w: int, h: int, prof: bool) -> None:
+        # Modo streaming: os comandos vão para o backend à medida que são gerados
+        self._drawn_state = None
+        commands = iter_draw_commands(w, h, self.margin, self.depth_layers, self.scale,
+                                      self.running_bond_offset, self.lod, self.line_width)
+        if self.backend == "raster":
+            self.item_count = 1
+            self._blit_raster(w, h, [], [], prof, commands)
+        else:
+            self._clear_canvas()
+            self.item_count = canvas_draw_commands(self.canvas, commands)
+
+    def _blit_raster(self, w: int, h: int, rings: List[Rect], joints: Joints, prof: bool,
+                     commands: Optional[Iterable[DrawCmd]] = None, bricks=None) -> None:
+        """Rasteriza a cena no buffer RGB e mostra-a como uma única PhotoImage."""
+        t = time.perf_counter() if prof else 0.0
+        if self._raster is None or (self._raster.w, self._raster.h) != (w, h):
+            self._raster = Raster(w, h, self.bg, self.use_numpy)
+        else:
+            self._raster.clear()
+        if commands is not None:
+            self._raster.draw_commands(commands)
+        elif prof:
+            if bricks is not None:
+                self._raster.fill_polygons(*bricks)
+                t = self._emit("fill", t)
+            self._raster.rects(rings, self.line_width)
+            t = self._emit("rings", t)
+            self._raster.lines(joints, max(1, self.line_width-1))
+            t = self._emit("joints", t)
+        else:
+            draw_raster(self._raster, rings, joints, self.line_width, bricks)
+
+        self._show_photo(tk.PhotoImage(width=w, height=h, data=self._raster.to_ppm(), format="PPM"))
+        if prof:
+            self._emit("blit", t)
+
+    def _show_photo(self, photo) -> None:
+        self._photo = photo
+        if self._image_item is None:
+            self._image_item = self.canvas.create_image(0, 0, anchor="nw", image=photo)
+        else:
+            self.canvas.itemconfigure(self._image_item, image=photo)
+
+    def prerender_loop(self) -> None:
+        """Preenche já todos os slots do período (em vez de durante a primeira volta)."""
+        if self.loop_cache is None:
+            self.loop_cache = LoopCache()
+        w, h = self._canvas_size()
+        phase = self.running_bond_offset
+        self._configure_loop(w, h)
+        for slot in range(self.loop_cache.count):
+            self.loop_cache.get(slot, lambda: self._loop_frame(w, h, slot))
+        self.running_bond_offset = phase
 
+    def _configure_loop(self, w: int, h: int) -> None:
+        count = int(round(LoopCache.PERIOD * self.anim_fps / max(self.anim_speed, 1e-6)))
+        self.loop_cache.configure((w, h, self.depth_layers, self.scale, self.margin, self.lod,
+                                   self.line_width, self.bg, self.backend, self.filled, self.shading),
+                                  count)
+
+    def _loop_frame(self, w: int, h: int, slot: int) -> Tuple[object, int]:
+        """Frame do slot: PhotoImage (raster) ou coordenadas (canvas), e os bytes que ocupa."""
+        self.running_bond_offset = self.loop_cache.phase(slot)
+        # sem passar pela GeometryCache: um período inteiro expulsaria tudo o resto
         frames = self._frames(w, h)
         if len(frames) < 2:
+            frames = []
+        joints = self._joints(frames)
+        rings = visible_rings(frames, self._ring_px)
+        bricks = None
+        if self.filled and len(frames) >= 2:
+            polys, layers, walls, ids = brick_quads(frames, joints, self.lod)
+            bricks = polys, brick_colors(layers, walls, ids, self.shading, self.use_numpy)
+        if self.backend != "raster":
+            joints = joint_tuples(joints)  # o canvas vai percorrê-las em todas as voltas
+            nbytes = _geometry_nbytes(frames, rings, joints)
+            if bricks is not None:
+                nbytes += sys.getsizeof(bricks[0]) + len(bricks[0]) * (
+                    sys.getsizeof([0.0] * 8) + 8 * sys.getsizeof(0.0) + sys.getsizeof((0,) * 3))
+            return (frames, rings, joints, bricks), nbytes
+        raster = Raster(w, h, self.bg, self.use_numpy)
+        draw_raster(raster, rings, joints, self.line_width, bricks)
+        # o Tk guarda a imagem a 32 bits por pixel
+        return tk.PhotoImage(width=w, height=h, data=raster.to_ppm(), format="PPM"), w * h * 4
+
+    def _redraw_loop(self, w: int, h: int, prof: bool) -> None:
+        # Animação a partir do LoopCache: a fase é arredondada ao slot mais próximo
+        loop = self.loop_cache
+        self._configure_loop(w, h)
+        slot = loop.slot(self.running_bond_offset)
+        t = time.perf_counter() if prof else 0.0
+        frame = loop.get(slot, lambda: self._loop_frame(w, h, slot))
+        self.running_bond_offset = loop.phase(slot)
+        self._drawn_state = None
+        if self.backend == "raster":
+            self.item_count = 1
+            self._show_photo(frame)
+            if prof:
+                self._emit("blit", t)
+            return
+        frames, rings, joints, bricks = frame
+        if not self.retained:
+            self._clear_canvas()
+        self._submit(w, h, frames, rings, joints, prof, bricks)
+
+    def _submit(self, w: int, h: int, frames: List[Rect], rings: List[Rect], joints: Joints,
+                prof: bool, bricks=None) -> None:
+        """Envia anéis e juntas (e os tijolos, se filled) para o backend escolhido."""
+        c = self.canvas
+        if bricks is None and self.filled and len(frames) >= 2:
+            bricks = self._bricks(w, h, frames, joints)
+        if self.backend == "raster":
+            self.item_count = 1
+            self._blit_raster(w, h, rings, joints, prof, bricks=bricks)
+            return
+        if bricks is not None:
+            self._fill_canvas(*bricks, prof)
+        joints = joint_tuples(joints)  # o canvas recebe as coordenadas junta a junta
+        if self.batch_joints and joints:
+            joints = joint_polylines(frames, joints, self.lod)
+        self.item_count = len(rings) + len(joints) + (len(bricks[0]) if bricks is not None else 0)
+        if not self.retained:
+            self._create_layers(frames, joints, 0, prof)
             return
 
+        t = time.perf_counter() if prof else 0.0
+        self._sync_pool(self._ring_pool, rings, lambda *xy: c.create_rectangle(
+            *xy, outline="black", width=self.line_width), self.line_width)
+        if prof:
+            t = self._emit("rings", t)
+        jw = max(1, self.line_width-1)
+        self._sync_pool(self._joint_pool, joints, lambda *xy: c.create_line(
+            *xy, width=jw, fill="black"), jw)
+        if prof:
+            self._emit("joints", t)
+
+    def _fill_canvas(self, polys, colors, prof: bool) -> None:
+        # Backend canvas: um polígono por tijolo, por baixo das linhas
+        c = self.canvas
+        t = time.perf_counter() if prof else 0.0
+        c.delete("fill")
+        for poly, color in zip(polys, colors):
+            c.create_polygon(*poly, fill="#%02x%02x%02x" % tuple(color), outline="", tags="fill")
+        c.tag_lower("fill")
+        if prof:
+            self._emit("fill", t)
+
+    def _create_layers(self, frames: List[Rect], joints: List[Segment], start: int, prof: bool) -> None:
+        """
+        Cria os itens dos anéis start.. e das juntas dos pares start-1.. .
+        Cada item leva a etiqueta "L<k>" (anel k) ou "J<k>" (juntas entre k e k+1).
+        """
+        c = self.canvas
+        t = time.perf_counter() if prof else 0.0
+        ring_px = self._ring_px
+        for k in range(start, len(frames)):
+            x1, y1, x2, y2 = frames[k]
+            if x2 - x1 > ring_px and y2 - y1 > ring_px:
+                c.create_rectangle(x1, y1, x2, y2, outline="black", width=self.line_width,
+                                   tags=("ring", "L%d" % k))
+        if prof:
+            t = self._emit("rings", t)
+
+        width = max(1, self.line_width-1)
+        if self.batch_joints:  # polilinhas por parede: não há uma etiqueta por camada
+            for xy in joints:
+                c.create_line(*xy, width=width, fill="black", tags="joint")
+        else:
+            pairs = joints_by_pair(frames, joints, self.lod)
+            for k in range(max(start - 1, 0), len(pairs)):
+                tag = ("joint", "J%d" % k)
+                for xy in pairs[k]:
+                    c.create_line(*xy, width=width, fill="black", tags=tag)
+        if prof:
+            self._emit("joints", t)
+
+    @property
+    def _ring_px(self) -> float:
+        return _ring_threshold(self.lod)
+
+    def _layer_state(self, w: int, h: int):
+        """Tudo o que muda os itens desenhados, exceto depth_layers (None = sem atualização incremental)."""
+        if self.backend != "canvas" or self.retained or self.batch_joints or self.filled:
+            return None
+        return (w, h, self.scale, self.margin, self.running_bond_offset, self.lod, self.line_width)
+
+    def _update_layers(self, frames: List[Rect], joints: Joints, prof: bool) -> None:
+        """
+        Só depth_layers mudou: como a lista de anéis para uma profundidade maior
+        começa pelos mesmos anéis, basta acrescentar ou apagar os do fundo.
+        """
+        old, new = self._drawn_layers, len(frames)
+        c = self.canvas
+        if new > old:
+            self._create_layers(frames, joint_tuples(joints), old, prof)
+        else:
+            for k in range(new, old):
+                c.delete("L%d" % k)
+            for k in range(max(new - 1, 0), old - 1):
+                c.delete("J%d" % k)
+        self.item_count = len(visible_rings(frames, self._ring_px)) + len(joints)
+
+    def _redraw_2d(self, w: int, h: int, prof: bool) -> None:
+        # Vista 2D clássica: geometria (via cache) e submissão completa ou incremental
+        frames, joints = self._geometry(w, h)
+        if len(frames) < 2:
+            frames = []
+
         # Desenhar os 'anéis' (as juntas horizontais do teto/chão e convergência das paredes)
-        for rect in frames:
-            x1, y1, x2, y2 = rect
-            if x2 -x1 > 50.0 and y2-y1>50.0:
-                
-                c.create_rectangle(x1, y1, x2, y2, outline="black", width=self.line_width)
+        rings = visible_rings(frames, self._ring_px)
 
         # Para sugerir tijolos reais nas paredes, desenhamos juntas verticais
         # que seguem um padrão deslocado (running bond) e tornam-se mais densas em profundidade.
-        t = self.running_bond_offset
-        counter=0;
-        for i in range(len(frames) - 1):
-                counter= counter % 2
-                x1, y1, x2, y2 = frames[i]
-                xn1, yn1, xn2, yn2 = frames[i + 1]
-                if x2 -x1 > 50.0 and y2-y1>50.0:
-                    xx1=(x2-x1)/16
-                    xxx1=(xn2-xn1)/16
-                    yy1=(y2-y1)/16
-                    yyy1=(yn2-yn1)/16
-                    
-                    for nn in range(0,16):
-                        
-                        c.create_line(x1+int(xx1*float(nn))+xx1*(counter*0.5),y1,xn1+int(xxx1*float(nn))+xxx1*(counter*0.5),yn1, width=max(1, self.line_width-1), fill="black")
-                        c.create_line(x1+int(xx1*float(nn))+xx1*(counter*0.5),y2,xn1+int(xxx1*float(nn))+xxx1*(counter*0.5),yn2, width=max(1, self.line_width-1), fill="black")
-                        c.create_line(x1,y1+int(yy1*float(nn))+yy1*(counter*0.5),xn1,yn1+int(yyy1*float(nn))+yyy1*(counter*0.5), width=max(1, self.line_width-1), fill="black")
-                        c.create_line(x2,y1+int(yy1*float(nn))+yy1*(counter*0.5),xn2,yn1+int(yyy1*float(nn))+yyy1*(counter*0.5), width=max(1, self.line_width-1), fill="black")
-
-                         
-                counter=counter+1
+        state = self._layer_state(w, h)
+        if (state is not None and state == self._drawn_state and len(frames) >= 2
+                and self.depth_layers != self._drawn_depth):
+            self._update_layers(frames, joints, prof)
+        else:
+            if not self.retained and self.backend == "canvas":
+                self._clear_canvas()
+            self._submit(w, h, frames, rings, joints, prof)
+        self._drawn_state = state if len(frames) >= 2 else None
+        self._drawn_layers = len(frames)
+        self._drawn_depth = self.depth_layers
+
+    def redraws(self, w: Optional[int] = None, h: Optional[int] = None):
+        """Refaz todo o desenho (linhas pretas sobre janela amarela); w/h por omissão = tamanho do canvas."""
+        c = self.canvas
+        prof = self._profiling
+        if prof:
+            start = time.perf_counter()
+            self.phase_times = {}
+        w = w or c.winfo_width() or 800
+        h = h or c.winfo_height() or 600
+
+        # fundo amarelo
+        c.configure(bg=self.bg)
+
+        # a câmara tem prioridade: o streaming só se aplica à vista 2D
+        if self.camera is not None:
+            self._redraw_camera(w, h, prof)
+        else:
+            if self._camera_drawn:
+                c.delete("camera")
+                self._camera_drawn = False
+            if self.streaming and not self.retained and not self.batch_joints and not self.filled:
+                self._redraw_stream(w, h, prof)
+            elif self.loop_cache is not None and self.animating:
+                self._redraw_loop(w, h, prof)
+            else:
+                self._redraw_2d(w, h, prof)
+        if prof:
+            self._emit("frame", start)
+            if self.hud:
+                self._draw_hud(self.phase_times["frame"])
                 
         """
         for tt in range(0,w,64):
@@ -121,16 +2468,623 @@ class GameEngine:
         """
             
 
-def main():
+
+class HeadlessRenderer:
+    """
+    Renderiza o túnel sem Tk (para servidores sem display). Usa a mesma
+    geometria que o GameEngine e reaproveita a cache e os buffers entre
+    frames, por isso exportar muitas imagens seguidas não reinicializa nada.
+    """
+
+    def __init__(self, margin: float = 16, depth_layers: int = 70, scale: float = 0.92,
+                 line_width: int = 2, bg="#FFD300", use_numpy: Optional[bool] = None,
+                 geometry_cache_size: int = 32):
+        self.margin = margin
+        self.depth_layers = depth_layers
+        self.scale = scale
+        self.line_width = line_width
+        self.running_bond_offset = 0.0
+        self.lod: Optional[LevelOfDetail] = None
+        self.bg = bg
+        self.use_numpy = use_numpy
+        self.geometry_cache = GeometryCache(geometry_cache_size)
+        self._rasters = {}
+        # tijolos preenchidos em render() (ver GameEngine.filled)
+        self.filled = False
+        self.shading = BrickShading()
+
+    def _geometry(self, w: int, h: int) -> Tuple[List[Rect], Joints]:
+        """Todos os anéis e as juntas, através da cache LRU (como GameEngine._geometry)."""
+        key = (w, h, self.depth_layers, self.scale, self.margin, self.running_bond_offset, self.lod)
+
+        def compute():
+            frames = tunnel_frames(w, h, self.margin, self.depth_layers, self.scale,
+                                   self.running_bond_offset, self.lod)
+            if len(frames) < 2:
+                return [], []
+            return frames, brick_joints(frames, self.use_numpy, phase_parity(self.running_bond_offset), self.lod)
+
+        return self.geometry_cache.get(key, compute)
+
+    def geometry(self, w: int, h: int) -> Tuple[List[Rect], Joints]:
+        """Anéis visíveis e juntas para uma imagem w x h (o mesmo que scene_geometry())."""
+        frames, joints = self._geometry(w, h)
+        return visible_rings(frames, _ring_threshold(self.lod)), joints
+
+    def commands(self, w: int, h: int) -> Iterator[DrawCmd]:
+        """Fluxo preguiçoso de comandos de desenho (não passa pela cache)."""
+        return iter_draw_commands(w, h, self.margin, self.depth_layers, self.scale,
+                                  self.running_bond_offset, self.lod, self.line_width)
+
+    def scene(self, w: int, h: int) -> Scene:
+        """A cena em forma compacta (Scene), guardada na cache de geometria."""
+        key = ("scene", w, h, self.depth_layers, self.scale, self.margin, self.running_bond_offset,
+               self.lod, self.line_width)
+        return self.geometry_cache.get(key, lambda: Scene.build(self.commands(w, h)))
+
+    def render_stream(self, w: int, h: int) -> Raster:
+        """Como render(), mas a consumir o fluxo de comandos: memória constante com a profundidade."""
+        raster = Raster(w, h, self.bg, self.use_numpy)
+        raster.draw_commands(self.commands(w, h))
+        return raster
+
+    def render(self, w: int, h: int) -> Raster:
+        """Rasteriza um frame; o Raster devolvido é reutilizado na próxima chamada com o mesmo tamanho."""
+        raster = self._rasters.get((w, h))
+        if raster is None or raster.bg != _rgb(self.bg):
+            raster = self._rasters[(w, h)] = Raster(w, h, self.bg, self.use_numpy)
+        else:
+            raster.clear()
+        rings, joints = self.geometry(w, h)
+        draw_raster(raster, rings, joints, self.line_width, self.bricks(w, h) if self.filled else None)
+        return raster
+
+    def bricks(self, w: int, h: int):
+        """(polígonos, cores) dos tijolos preenchidos, guardados na cache de geometria."""
+        key = ("bricks", w, h, self.depth_layers, self.scale, self.margin, self.running_bond_offset,
+               self.lod, self.shading, self.use_numpy)
+
+        def compute():
+            frames, joints = self._geometry(w, h)
+            if len(frames) < 2:
+                return [], []
+            polys, layers, walls, ids = brick_quads(frames, joints, self.lod)
+            return polys, brick_colors(layers, walls, ids, self.shading, self.use_numpy)
+
+        return self.geometry_cache.get(key, compute)
+
+    def export(self, path: str, w: int, h: int, tile: int = 0, workers: Optional[int] = None) -> None:
+        """
+        Grava um frame em PNG, PPM, SVG ou EPS consoante a extensão de `path`.
+        Com `tile` > 0 a imagem é rasterizada em ladrilhos por vários processos (export_tiled).
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".svg":
+            write_svg(path, w, h, lambda: self.commands(w, h), self.bg)
+            return
+        if ext in (".eps", ".ps"):
+            write_eps(path, w, h, lambda: self.commands(w, h), self.bg)
+            return
+        if tile:
+            rings, joints = self.geometry(w, h)
+            export_tiled(path, w, h, rings, joints, self.line_width, self.bg, tile, workers, self.use_numpy,
+                         self.bricks(w, h) if self.filled else None)
+            return
+        raster = self.render(w, h)
+        data = raster.to_png() if ext == ".png" else raster.to_ppm()
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def export_sequence(self, out: str, w: int, h: int, frames: int, step: Optional[float] = None,
+                        fmt: str = "png", queue_size: int = 4) -> Dict[str, Dict[str, float]]:
+        """
+        Exporta `frames` frames com a fase a avançar `step` por frame (por
+        omissão 2/frames: a cena repete-se ao fim de 2 passos de anel, pela
+        paridade do running bond, e o ciclo fecha sem salto).
+
+        Geometria, rasterização e escrita correm em threads ligadas por filas
+        de `queue_size` frames. Com fmt "png" grava out/frame_00000.png, ...;
+        com fmt "raw" escreve RGB24 cru em `out` ("-" para o stdout, p. ex.
+        para `ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -i -`).
+        Devolve, por fase, frames, tempo ocupado e frames/s; a fase com menos
+        frames/s é o gargalo.
+        """
+        if step is None:
+            step = 2.0 / frames
+        base = self.running_bond_offset
+        params = (w, h, self.margin, self.depth_layers, self.scale)
+        lod, use_numpy, line_width, bg = self.lod, self.use_numpy, self.line_width, self.bg
+
+        def geometry(i):
+            return i, scene_geometry(*params, base + i * step, lod, use_numpy)
+
+        def rasterize(item):
+            i, (rings, joints) = item
+            raster = Raster(w, h, bg, use_numpy)
+            draw_raster(raster, rings, joints, line_width)
+            return i, raster
+
+        if fmt == "raw":
+            if out != "-" and os.path.isdir(out):
+                raise ValueError("a saída raw é um só ficheiro (ou '-' para o stdout), não o diretório %r" % (out,))
+            sink = sys.stdout.buffer if out == "-" else open(out, "wb")
+
+            def write(item):
+                sink.write(item[1].buf)
+        else:
+            os.makedirs(out, exist_ok=True)
+            sink = None
+
+            def write(item):
+                i, raster = item
+                with open(os.path.join(out, "frame_%05d.png" % i), "wb") as f:
+                    f.write(raster.to_png())
+
+        stop, stats, errors = threading.Event(), {}, []
+        q_geom, q_raster = queue.Queue(queue_size), queue.Queue(queue_size)
+        stages = [("geometry", geometry, None, q_geom, range(frames)),
+                  ("raster", rasterize, q_geom, q_raster, ()),
+                  ("write", write, q_raster, None, ())]
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=_pipeline_stage, name="seq-" + name,
+                                    args=(name, work, inbox, outbox, stop, stats, errors, source),
+                                    daemon=True)
+                   for name, work, inbox, outbox, source in stages]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            stop.set()
+            if sink is not None and sink is not sys.stdout.buffer:
+                sink.close()
+            elif sink is not None:
+                sink.flush()
+        if errors:
+            raise errors[0]
+        wall = time.perf_counter() - t0
+        stats["total"] = {"frames": frames, "busy_s": wall, "fps": frames / wall if wall else 0.0}
+        return stats
+
+
+# ---------------------------------------------------------------------------
+# Sequências de frames (fase a rodar) num pipeline de três fases em threads:
+# geometria do frame N+1, rasterização do N e escrita do N-1 em simultâneo,
+# com filas limitadas entre fases para a memória não crescer.
+# ---------------------------------------------------------------------------
+
+_SEQ_END = object()  # marca de fim de fluxo entre fases
+
+
+def _pipeline_stage(name: str, work: Callable, inbox: Optional["queue.Queue"],
+                    outbox: Optional["queue.Queue"], stop: threading.Event,
+                    stats: Dict[str, Dict[str, float]], errors: List[BaseException],
+                    source: Iterable = ()) -> None:
+    """Corpo de uma fase: lê de `inbox` (ou de `source`), aplica `work` e passa o resultado a `outbox`."""
+    busy, n = 0.0, 0
+    items = iter(source) if inbox is None else iter(inbox.get, _SEQ_END)
+    try:
+        for item in items:
+            if stop.is_set():
+                break
+            t = time.perf_counter()
+            result = work(item)
+            busy += time.perf_counter() - t
+            n += 1
+            if outbox is not None:
+                while not stop.is_set():
+                    try:
+                        outbox.put(result, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+    except BaseException as e:  # a exceção é relançada pela thread principal
+        errors.append(e)
+        stop.set()
+    finally:
+        stats[name] = {"frames": n, "busy_s": busy, "fps": n / busy if busy else 0.0}
+        if outbox is not None:
+            # sem bloquear: se a fase seguinte parou, a fila pode estar cheia
+            while True:
+                try:
+                    outbox.put(_SEQ_END, timeout=0.1)
+                    break
+                except queue.Full:
+                    if stop.is_set():
+                        break
+        if inbox is not None and stop.is_set():
+            # esvazia para desbloquear a fase anterior
+            while True:
+                try:
+                    inbox.get_nowait()
+                except queue.Empty:
+                    break
+
+
+# ---------------------------------------------------------------------------
+# Varrimento de parâmetros: uma grelha de variantes (scale x depth_layers x
+# margin x line_width) rasterizada em paralelo, para um diretório de PNGs ou
+# uma folha de contactos.
+# ---------------------------------------------------------------------------
+
+class SweepVariant(NamedTuple):
+    scale: float
+    depth_layers: int
+    margin: float
+    line_width: int
+
+
+def sweep_variants(scales: Iterable[float], depths: Iterable[int], margins: Iterable[float],
+                   line_widths: Iterable[int]) -> List[SweepVariant]:
+    """Produto cartesiano dos valores, pela ordem scale, depth_layers, margin, line_width."""
+    return [SweepVariant(*v) for v in itertools.product(scales, depths, margins, line_widths)]
+
+
+def _render_sweep_group(w: int, h: int, phase: float, lod: Optional[LevelOfDetail], bg,
+                        use_numpy: Optional[bool],
+                        variants: List[Tuple[int, SweepVariant]]) -> List[Tuple[int, bytes]]:
+    """
+    Corre num processo do pool. Todas as variantes têm o mesmo scale e margin:
+    a geometria é calculada uma vez para a maior profundidade e cada variante
+    usa um prefixo (os anéis de depth_layers=d são os d primeiros, e as juntas
+    vêm por par de anéis). line_width não mexe na geometria.
+    """
+    scale, margin = variants[0][1].scale, variants[0][1].margin
+    frames = tunnel_frames(w, h, margin, max(v.depth_layers for _, v in variants), scale, phase, lod)
+    joints = brick_joints(frames, use_numpy, phase_parity(phase), lod)
+    ring_px = _ring_threshold(lod)
+    raster = Raster(w, h, bg, use_numpy)
+    out = []
+    for i, v in variants:
+        sub = frames[:v.depth_layers]
+        if len(sub) < 2:
+            rings, sub_joints = [], []
+        else:
+            rings = visible_rings(sub, ring_px)
+            sub_joints = joints[:sum(2 * nx + 2 * ny for _, nx, ny in _kept_pairs(sub, lod))]
+        raster.clear()
+        draw_raster(raster, rings, sub_joints, v.line_width)
+        out.append((i, bytes(raster.buf)))
+    return out
+
+
+def iter_sweep(w: int, h: int, variants: Sequence[SweepVariant], phase: float = 0.0,
+               lod: Optional[LevelOfDetail] = None, bg="#FFD300", workers: Optional[int] = None,
+               use_numpy: Optional[bool] = None) -> Iterator[Tuple[int, SweepVariant, Raster]]:
+    """
+    Rasteriza as variantes num ProcessPoolExecutor e devolve (índice, variante,
+    Raster) à medida que ficam prontas (fora de ordem). As variantes são
+    agrupadas por (scale, margin) para partilharem a geometria; grupos grandes
+    são partidos para haver trabalho para todos os processos.
+    """
+    workers = workers or os.cpu_count() or 1
+    groups: Dict[Tuple[float, float], List[Tuple[int, SweepVariant]]] = {}
+    for i, v in enumerate(variants):
+        groups.setdefault((v.scale, v.margin), []).append((i, v))
+    per_task = max(1, math.ceil(len(variants) / (2 * workers)))
+    tasks = []
+    for group in groups.values():
+        group.sort(key=lambda item: item[1].depth_layers)
+        tasks.extend(group[k:k + per_task] for k in range(0, len(group), per_task))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(_render_sweep_group, w, h, phase, lod, bg, use_numpy, task)
+                for task in tasks]
+        for job in concurrent.futures.as_completed(jobs):
+            for i, buf in job.result():
+                yield i, variants[i], Raster(w, h, bg, use_numpy, buf=bytearray(buf))
+
+
+def contact_sheet(w: int, h: int, count: int, results: Iterable[Tuple[int, SweepVariant, Raster]],
+                  cols: int = 0, gap: int = 8, bg="#404040") -> Raster:
+    """Monta os resultados de iter_sweep() numa grelha (variante i na célula i, por linhas)."""
+    cols = cols or max(1, math.ceil(math.sqrt(count)))
+    rows = max(1, math.ceil(count / cols))
+    sheet = Raster(cols * (w + gap) + gap, rows * (h + gap) + gap, bg)
+    stride, row = sheet.w * 3, w * 3
+    for i, _, tile in results:
+        x0 = gap + (i % cols) * (w + gap)
+        y0 = gap + (i // cols) * (h + gap)
+        for y in range(h):
+            o = (y0 + y) * stride + x0 * 3
+            sheet.buf[o:o + row] = tile.buf[y * row:(y + 1) * row]
+    return sheet
+
+
+def sweep(w: int, h: int, variants: Sequence[SweepVariant], out: str = ".",
+          sheet: Optional[str] = None, phase: float = 0.0, lod: Optional[LevelOfDetail] = None,
+          bg="#FFD300", workers: Optional[int] = None, cols: int = 0) -> List[str]:
+    """
+    Grava cada variante em out/ (um PNG por variante) ou, com `sheet`, uma só
+    folha de contactos nesse ficheiro. Devolve os ficheiros escritos.
+    """
+    results = iter_sweep(w, h, variants, phase, lod, bg, workers)
+    if sheet:
+        image = contact_sheet(w, h, len(variants), results, cols)
+        with open(sheet, "wb") as f:
+            f.write(image.to_png() if sheet.lower().endswith(".png") else image.to_ppm())
+        return [sheet]
+    os.makedirs(out, exist_ok=True)
+    written = []
+    for _, v, raster in results:
+        path = os.path.join(out, "tunnel_%dx%d_d%d_s%g_m%g_lw%d.png"
+                            % (w, h, v.depth_layers, v.scale, v.margin, v.line_width))
+        with open(path, "wb") as f:
+            f.write(raster.to_png())
+        written.append(path)
+    return written
+
+
+# ---------------------------------------------------------------------------
+# Benchmark: geometria vs. submissão ao canvas, nº de itens e memória de pico
+# ---------------------------------------------------------------------------
+
+BENCH_SIZES = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+BENCH_DEPTHS = [10, 50, 100, 200]
+BENCH_SCALES = [0.80, 0.88, 0.92, 0.97]
+
+
+def _median_time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def _peak_kib(fn) -> float:
+    # Só conta alocações Python (as do Tk/Tcl em C não são visíveis ao tracemalloc)
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024.0
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(sizes=None, depths=None, scales=None, backend: str = "canvas",
+                  repeat: int = 3, lod: Optional[LevelOfDetail] = None) -> List[dict]:
+    """
+    Mede o redesenho completo numa grelha de tamanhos x depth_layers x scale.
+    Com backend "canvas"/"raster" usa um GameEngine numa janela Tk escondida;
+    sem display (ou com backend "headless") mede o HeadlessRenderer.
+    A cache de geometria fica desligada para medir sempre o trabalho todo.
+    """
+    root = engine = None
+    if backend != "headless" and tk is not None:
+        try:
+            root = tk.Tk()
+        except tk.TclError:
+            backend = "headless"
+    if root is not None:
+        root.withdraw()
+        engine = GameEngine(root, backend=backend, geometry_cache_size=0)
+        engine.lod = lod
+        target = engine
+    else:
+        target = HeadlessRenderer(geometry_cache_size=0)
+        target.lod = lod
+
+    results = []
+    try:
+        for (w, h), depth, scale in itertools.product(sizes or BENCH_SIZES, depths or BENCH_DEPTHS,
+                                                      scales or BENCH_SCALES):
+            target.depth_layers, target.scale = depth, scale
+            rings, joints = scene_geometry(w, h, target.margin, depth, scale, 0.0, lod, target.use_numpy)
+            geometry = _median_time(lambda: scene_geometry(
+                w, h, target.margin, depth, scale, 0.0, lod, target.use_numpy), repeat)
+            if engine is not None:
+                def frame():
+                    engine._drawn_state = None  # sempre o redesenho completo, nunca o incremental
+                    engine.redraws(w, h)
+                    root.update_idletasks()
+            else:
+                def frame():
+                    target.render(w, h)
+            total = _median_time(frame, repeat)
+            peak = _peak_kib(frame)
+            if engine is None:
+                items = 0
+            else:
+                items = len(engine.canvas.find_all())
+            results.append({
+                "backend": backend, "width": w, "height": h, "depth_layers": depth, "scale": scale,
+                "rings": len(rings), "joints": len(joints), "items": items,
+                "geometry_ms": geometry * 1000.0, "submit_ms": max(0.0, total - geometry) * 1000.0,
+                "frame_ms": total * 1000.0, "peak_kib": peak,
+            })
+    finally:
+        if root is not None:
+            root.destroy()
+    return results
+
+
+def write_benchmark(results: List[dict], path: Optional[str] = None) -> None:
+    """Grava os resultados em JSON ou CSV (pela extensão); sem path, JSON para stdout."""
+    if path and path.lower().endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]) if results else [])
+            writer.writeheader()
+            writer.writerows(results)
+        return
+    data = json.dumps(results, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+    else:
+        sys.stdout.write(data + "\n")
+
+
+def _parse_size(text: str) -> Tuple[int, int]:
+    try:
+        w, h = text.lower().split("x")
+        return int(w), int(h)
+    except ValueError:
+        raise argparse.ArgumentTypeError("tamanho inválido %r (use LxA, ex.: 1920x1080)" % text)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Túnel de tijolos em perspetiva (GUI Tk ou exportação sem display).")
+    p.add_argument("--headless", action="store_true",
+                   help="não abre janela: exporta imagens para --out")
+    p.add_argument("--backend", choices=("canvas", "raster"), default="canvas",
+                   help="backend de desenho da GUI")
+    p.add_argument("--retained", action="store_true", help="GUI: reaproveitar os itens do canvas")
+    p.add_argument("--batch-joints", action="store_true", help="GUI: uma polilinha de juntas por parede")
+    p.add_argument("--streaming", action="store_true", help="GUI: geometria como fluxo de comandos, sem cache")
+    p.add_argument("--animate", action="store_true", help="GUI: começar com o voo pelo túnel ligado")
+    p.add_argument("--hud", action="store_true", help="GUI: mostrar o HUD de desempenho")
+    p.add_argument("--camera", action="store_true", help="GUI: câmara 3D (setas, [w]/[s]; [c] alterna)")
+    p.add_argument("--path", action="store_true",
+                   help="GUI: túnel curvo ao longo de uma spline de demonstração (implica --camera)")
+    p.add_argument("--no-cull", action="store_true",
+                   help="GUI: câmara 3D sem recorte de segmentos fora do ecrã/ocultos")
+    p.add_argument("--fov", type=float, default=90.0, help="GUI: campo de visão vertical da câmara, em graus")
+    p.add_argument("--filled", action="store_true",
+                   help="tijolos preenchidos, escurecidos com a profundidade ([f] alterna na GUI)")
+    p.add_argument("--loop-frames", type=int, default=0,
+                   help="GUI: animar a partir de um período pré-calculado, guardando até N frames")
+    p.add_argument("--phase", type=float, default=0.0,
+                   help="fase do running bond (running_bond_offset), em passos de anel")
+    p.add_argument("--size", type=_parse_size, action="append",
+                   help="tamanho LxA (pode repetir; por omissão 900x600)")
+    p.add_argument("--depth", type=int, action="append", help="depth_layers (pode repetir)")
+    p.add_argument("--scale", type=float, action="append", help="fator de escala (pode repetir)")
+    p.add_argument("--margin", type=float, action="append", help="margem em px (pode repetir)")
+    p.add_argument("--line-width", type=int, default=2)
+    p.add_argument("--lod", action="store_true", help="nível de detalhe (juntas por tamanho no ecrã)")
+    p.add_argument("--format", choices=("png", "ppm", "svg", "eps"), action="append",
+                   help="formato(s) de saída (por omissão png)")
+    p.add_argument("--out", default=".", help="diretório de saída (com --raw: ficheiro ou '-')")
+    p.add_argument("--tile", type=int, default=0,
+                   help="exportar em ladrilhos de NxN px rasterizados em paralelo (imagens muito grandes)")
+    p.add_argument("--workers", type=int, help="processos para --tile (por omissão, um por CPU)")
+    p.add_argument("--bench", nargs="?", const="-", metavar="FICHEIRO",
+                   help="corre o benchmark (grelha de --size/--depth/--scale) e grava JSON/CSV")
+    p.add_argument("--repeat", type=int, default=3, help="benchmark: repetições por medição")
+    p.add_argument("--sweep", action="store_true",
+                   help="varrimento: todas as combinações de --depth/--scale/--margin/--sweep-line-width")
+    p.add_argument("--sweep-line-width", type=int, action="append",
+                   help="varrimento: line_width (pode repetir; por omissão --line-width)")
+    p.add_argument("--sheet", metavar="FICHEIRO",
+                   help="varrimento: uma folha de contactos (PNG/PPM) em vez de um PNG por variante em --out")
+    p.add_argument("--cols", type=int, default=0, help="varrimento: colunas da folha de contactos")
+    p.add_argument("--frames", type=int, default=0,
+                   help="exporta uma sequência de N frames com a fase a rodar (pipeline em threads)")
+    p.add_argument("--step", type=float, help="sequência: avanço da fase por frame (por omissão 2/N, ciclo fechado)")
+    p.add_argument("--raw", action="store_true",
+                   help="sequência: RGB24 cru para o ficheiro --out ('-' = stdout) em vez de PNGs numerados")
+    return p
+
+
+def run_headless(args: argparse.Namespace) -> List[str]:
+    """Exporta todas as combinações de tamanho x parâmetros; devolve os ficheiros escritos."""
+    renderer = HeadlessRenderer(line_width=args.line_width)
+    renderer.running_bond_offset = args.phase
+    renderer.lod = LevelOfDetail() if args.lod else None
+    renderer.filled = args.filled
+    os.makedirs(args.out, exist_ok=True)
+    written = []
+    combos = itertools.product(args.size or [(900, 600)], args.depth or [renderer.depth_layers],
+                               args.scale or [renderer.scale], args.margin or [renderer.margin])
+    for (w, h), depth, scale, margin in combos:
+        renderer.depth_layers, renderer.scale, renderer.margin = depth, scale, margin
+        for fmt in args.format or ["png"]:
+            name = "tunnel_%dx%d_d%d_s%g_m%g.%s" % (w, h, depth, scale, margin, fmt)
+            path = os.path.join(args.out, name)
+            renderer.export(path, w, h, args.tile, args.workers)
+            written.append(path)
+            print(path)
+    return written
+
+
+def run_sweep(args: argparse.Namespace) -> List[str]:
+    """Varrimento pela linha de comandos; com --sheet lista também o conteúdo de cada célula."""
+    d = HeadlessRenderer()
+    w, h = (args.size or [(300, 200)])[0]
+    variants = sweep_variants(args.scale or [d.scale], args.depth or [d.depth_layers],
+                              args.margin or [d.margin], args.sweep_line_width or [args.line_width])
+    written = sweep(w, h, variants, args.out, args.sheet, args.phase,
+                    LevelOfDetail() if args.lod else None, workers=args.workers, cols=args.cols)
+    for path in written:
+        print(path)
+    if args.sheet:
+        for i, v in enumerate(variants):
+            print("%d: scale=%g depth_layers=%d margin=%g line_width=%d" % ((i,) + v))
+    return written
+
+
+def run_sequence(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Exporta a sequência de --frames frames e reporta o débito de cada fase no stderr."""
+    renderer = HeadlessRenderer(line_width=args.line_width)
+    renderer.running_bond_offset = args.phase
+    renderer.lod = LevelOfDetail() if args.lod else None
+    renderer.depth_layers = (args.depth or [renderer.depth_layers])[0]
+    renderer.scale = (args.scale or [renderer.scale])[0]
+    renderer.margin = (args.margin or [renderer.margin])[0]
+    w, h = (args.size or [(900, 600)])[0]
+    stats = renderer.export_sequence(args.out, w, h, args.frames, args.step,
+                                     "raw" if args.raw else "png")
+    for name, s in stats.items():
+        print("%-8s %5d frames  %8.3f s  %8.1f frames/s" % (name, s["frames"], s["busy_s"], s["fps"]),
+              file=sys.stderr)
+    return stats
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.bench:
+        backend = "headless" if args.headless else args.backend
+        results = run_benchmark(args.size, args.depth, args.scale, backend, args.repeat,
+                                LevelOfDetail() if args.lod else None)
+        write_benchmark(results, None if args.bench == "-" else args.bench)
+        return
+    if args.sweep:
+        run_sweep(args)
+        return
+    if args.frames:
+        try:
+            run_sequence(args)
+        except ValueError as e:  # p. ex. --raw com um diretório em --out
+            parser.error(str(e))
+        return
+    if args.headless:
+        run_headless(args)
+        return
+
+    _require_tk()
     root = tk.Tk()
     root.title("Brick Tunnel - GUI Amarela (linhas pretas)")
     # Janela com fundo amarelo (também visível à volta do canvas se redimensionar)
     root.configure(bg="#FFD300")
-    root.geometry("900x600")
-    engine = GameEngine(root)
+    w, h = (args.size or [(900, 600)])[0]
+    root.geometry("%dx%d" % (w, h))
+    engine = GameEngine(root, retained=args.retained, backend=args.backend, hud=args.hud,
+                        batch_joints=args.batch_joints, streaming=args.streaming,
+                        loop_cache=LoopCache(args.loop_frames) if args.loop_frames else None,
+                        camera=Camera(fov=args.fov) if args.camera or args.path else None)
+    if args.path:
+        engine.path = TunnelPath.wavy()
+    engine.culling = not args.no_cull
+    engine.filled = args.filled
+    if args.depth:
+        engine.depth_layers = args.depth[0]
+    if args.scale:
+        engine.scale = args.scale[0]
+    if args.margin:
+        engine.margin = args.margin[0]
+    engine.line_width = args.line_width
+    engine.running_bond_offset = args.phase
+    engine.lod = LevelOfDetail() if args.lod else None
+    engine.request_redraw()
+    if args.animate:
+        engine.start_animation()
 
-    # Redesenhar periodicamente é opcional; aqui não animamos para manter 100% estático e limpo.
+    # Redesenhar periodicamente é opcional; por omissão não animamos para manter 100% estático
+    # e limpo ([espaço] ou --animate ligam o voo pelo túnel).
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()